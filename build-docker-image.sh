@@ -2,11 +2,18 @@
 
 # Helper for building Docker images on Jenkins. It uses environment
 # variables set by Jenkins to affect the build.
+#
+# With --profile DIR (or DOCKER_BUILD_PROFILE=DIR), the time taken by each
+# step and the size of each layer (compared to the previously pushed image)
+# are written to DIR/profile.json and DIR/profile.html.
 
 set -e
-if [ "$#" -lt 1 ]; then
-    echo "Usage: build-docker-image.sh [--push-external] image-name [args]" 1>&2
+usage() {
+    echo "Usage: build-docker-image.sh [--push-external] [--profile DIR] image-name [args]" 1>&2
     exit 1
+}
+if [ "$#" -lt 1 ]; then
+    usage
 fi
 if [ -z "$DOCKER_REGISTRY" ]; then
     echo "DOCKER_REGISTRY is not set" 1>&2
@@ -17,13 +24,31 @@ if [ -z "$BRANCH_NAME" ]; then
     exit 1
 fi
 push_external=0
-if [ "$1" = "--push-external" ]; then
-    if [ -z "$DOCKER_EXTERNAL_REGISTRY" ]; then
-        echo "DOCKER_EXTERNAL_REGISTRY must be set when using --push-external" 1>& 2
-        exit 1
-    fi
-    push_external=1
-    shift
+profile_dir="$DOCKER_BUILD_PROFILE"
+while true; do
+    case "$1" in
+        --push-external)
+            if [ -z "$DOCKER_EXTERNAL_REGISTRY" ]; then
+                echo "DOCKER_EXTERNAL_REGISTRY must be set when using --push-external" 1>& 2
+                exit 1
+            fi
+            push_external=1
+            shift
+            ;;
+        --profile)
+            if [ "$#" -lt 2 ]; then
+                usage
+            fi
+            profile_dir="$2"
+            shift 2
+            ;;
+        *)
+            break
+            ;;
+    esac
+done
+if [ "$#" -lt 1 ]; then
+    usage
 fi
 
 NAME="$1"
@@ -58,14 +83,33 @@ if grep -q '^ARG TAG' Dockerfile; then
     build_args+=(--build-arg "TAG=$LABEL")
 fi
 
-$docker_build --label=org.label-schema.schema-version=1.0 \
-              --label=org.label-schema.vcs-ref="$(git rev-parse HEAD)" \
-              --label=org.label-schema.vcs-url="$(git remote get-url origin)" \
-              --label=org.opencontainers.image.revision="$(git rev-parse HEAD)" \
-              --label=org.opencontainers.image.source="$(git remote get-url origin)" \
-              ${build_args[@]} \
-              --pull=true --no-cache=true --force-rm=true \
-              -t "$DOCKER_REGISTRY/$NAME:$LABEL" "$@" .
+vcs_ref="$(git rev-parse HEAD)" || true
+vcs_url="$(git remote get-url origin)" || true
+declare -a build_cmd
+build_cmd=($docker_build --label=org.label-schema.schema-version=1.0
+           --label=org.label-schema.vcs-ref="$vcs_ref"
+           --label=org.label-schema.vcs-url="$vcs_url"
+           --label=org.opencontainers.image.revision="$vcs_ref"
+           --label=org.opencontainers.image.source="$vcs_url"
+           ${build_args[@]}
+           --pull=true --no-cache=true --force-rm=true
+           -t "$DOCKER_REGISTRY/$NAME:$LABEL" "$@" .)
+if [ -n "$profile_dir" ]; then
+    # Fetch the previously pushed image (if any) to compare layer sizes. It
+    # is referred to by ID since the build will take over the tag.
+    previous_id=""
+    if docker pull "$DOCKER_REGISTRY/$NAME:$LABEL" > /dev/null 2>&1; then
+        previous_id="$(docker image inspect --format '{{.Id}}' "$DOCKER_REGISTRY/$NAME:$LABEL")"
+    fi
+    python3 "$(dirname "$0")/build_profile.py" --output "$profile_dir" \
+        --image "$DOCKER_REGISTRY/$NAME:$LABEL" ${previous_id:+--previous "$previous_id"} \
+        -- "${build_cmd[@]}"
+    if [ -n "$previous_id" ]; then
+        docker rmi "$previous_id" > /dev/null 2>&1 || true
+    fi
+else
+    "${build_cmd[@]}"
+fi
 # Remove the image, whether push is successful or not, to avoid accumulating
 # more and more images on the build slaves. This is skipped for Jenkins
 # images, since they are actually used on the build machines.
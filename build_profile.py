@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Profile a Docker image build. This is used by build-docker-image.sh when
+profiling is enabled.
+
+It runs the build command, passing its output through while recording the
+time at which each line appears, to determine how long each Dockerfile step
+takes. Both the classic builder output ("Step 3/12 : RUN ...") and BuildKit
+plain progress output ("#5 [3/12] RUN ...", "#5 DONE 12.3s") are
+understood. After a successful build it uses ``docker history`` to find the
+size of each layer of the image, and compares them with the layers of a
+previous image (typically the previously pushed version of the same tag).
+
+History entries cannot reliably be matched to steps by their text (for
+example, the classic builder records COPY as ``COPY file:<hash> in <dst>``,
+and instructions such as ``USER root`` may be repeated). Instead, the steps
+of the final stage that create layers (RUN, COPY and ADD) are matched by
+position to the last entries of the history that were created by those
+instructions.
+
+The results are written to ``profile.json`` and ``profile.html`` in the
+output directory.
+"""
+
+import argparse
+import html
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Dict, IO, List, Optional, Sequence, Tuple
+
+
+CLASSIC_STEP_RE = re.compile(r'^Step (?P<step>\d+)/\d+ : (?P<instruction>.*)$')
+BUILDKIT_STEP_RE = re.compile(r'^#(?P<id>\d+) \[(?P<stage>[^\]]+)\] (?P<instruction>.*)$')
+BUILDKIT_DONE_RE = re.compile(r'^#(?P<id>\d+) (?P<status>DONE (?P<time>[\d.]+)s|CACHED)$')
+# Prefixes that docker history adds to the instruction that created a layer
+HISTORY_PREFIX_RE = re.compile(r'^(\|\d+( \S+=\S*)* )?(/bin/sh -c (#\(nop\) )?)?')
+# Build arguments that docker history puts before the command of a RUN
+HISTORY_ARGS_RE = re.compile(r'^\|\d+( \S+=\S*)* ')
+BUILDKIT_STAGE_RE = re.compile(r'^(?:(?P<name>.*) )?\d+/\d+$')
+#: Instructions that create filesystem layers
+LAYER_INSTRUCTIONS = {'RUN', 'COPY', 'ADD'}
+
+
+class Step:
+    def __init__(self, name: str, instruction: str, start: float,
+                 stage: Optional[str] = None) -> None:
+        self.name = name
+        self.instruction = instruction
+        self.stage = stage          # None for steps that aren't part of the Dockerfile
+        self.start = start
+        self.time: Optional[float] = None
+        self.cached = False
+        self.layer_size: Optional[int] = None
+        self.previous_size: Optional[int] = None
+
+    def to_dict(self) -> dict:
+        delta = None
+        if self.layer_size is not None and self.previous_size is not None:
+            delta = self.layer_size - self.previous_size
+        return {
+            'step': self.name,
+            'instruction': self.instruction,
+            'time': self.time,
+            'cached': self.cached,
+            'layer_size': self.layer_size,
+            'previous_size': self.previous_size,
+            'size_delta': delta
+        }
+
+
+class StepParser:
+    """Incrementally parse build output to determine step times."""
+
+    def __init__(self) -> None:
+        self.steps: List[Step] = []
+        self._classic: Optional[Step] = None
+        self._classic_stages = 0
+        self._buildkit: Dict[str, Step] = {}
+
+    def feed(self, line: str, now: float) -> None:
+        match = CLASSIC_STEP_RE.match(line)
+        if match:
+            self.finish(now)
+            instruction = match.group('instruction')
+            if instruction_kind(instruction) == 'FROM':
+                self._classic_stages += 1
+            self._classic = Step(match.group('step'), instruction, now,
+                                 str(self._classic_stages))
+            self.steps.append(self._classic)
+            return
+        if self._classic is not None and line.strip() == '---> Using cache':
+            self._classic.cached = True
+            return
+        match = BUILDKIT_STEP_RE.match(line)
+        if match:
+            stage_match = BUILDKIT_STAGE_RE.match(match.group('stage'))
+            stage = (stage_match.group('name') or '') if stage_match else None
+            step = Step(match.group('stage'), match.group('instruction'), now, stage)
+            self._buildkit[match.group('id')] = step
+            self.steps.append(step)
+            return
+        match = BUILDKIT_DONE_RE.match(line)
+        if match and match.group('id') in self._buildkit:
+            step = self._buildkit.pop(match.group('id'))
+            if match.group('time') is not None:
+                step.time = float(match.group('time'))
+            else:
+                step.cached = True
+                step.time = 0.0
+
+    def finish(self, now: float) -> None:
+        """Mark the end of the current classic-builder step."""
+        if self._classic is not None:
+            self._classic.time = now - self._classic.start
+            self._classic = None
+
+    def final_stage(self) -> List[Step]:
+        """Get the steps of the final stage of the Dockerfile.
+
+        The final stage depends on all the others, so its last step is the
+        last one to be started.
+        """
+        stages = [step.stage for step in self.steps if step.stage is not None]
+        if not stages:
+            return []
+        return [step for step in self.steps if step.stage == stages[-1]]
+
+
+def run_build(args: Sequence[str], parser: StepParser, output: IO[str] = sys.stdout) -> int:
+    with subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          universal_newlines=True, bufsize=1) as proc:
+        assert proc.stdout is not None
+        for line in proc.stdout:
+            output.write(line)
+            output.flush()
+            parser.feed(line.rstrip('\n'), time.monotonic())
+    parser.finish(time.monotonic())
+    return proc.returncode
+
+
+def normalise_instruction(instruction: str) -> str:
+    """Reduce an instruction to a form comparable between build output and history.
+
+    >>> normalise_instruction('|2 TAG=latest /bin/sh -c apt-get   update # buildkit')
+    'apt-get update'
+    >>> normalise_instruction('/bin/sh -c #(nop)  ENV PATH=/usr/bin')
+    'ENV PATH=/usr/bin'
+    >>> normalise_instruction('RUN apt-get update')
+    'apt-get update'
+    """
+    if instruction.startswith('RUN '):
+        instruction = instruction[4:]
+    if instruction.endswith(' # buildkit'):
+        instruction = instruction[:-len(' # buildkit')]
+    instruction = HISTORY_PREFIX_RE.sub('', instruction)
+    if instruction.startswith('RUN '):
+        instruction = instruction[4:]
+        instruction = HISTORY_PREFIX_RE.sub('', instruction)
+    return ' '.join(instruction.split())
+
+
+def instruction_kind(instruction: str) -> str:
+    """Get the Dockerfile instruction keyword from a step or history entry.
+
+    >>> instruction_kind('COPY --from=build /a /b')
+    'COPY'
+    >>> instruction_kind('/bin/sh -c #(nop)  USER kat')
+    'USER'
+    >>> instruction_kind('|1 TAG=latest /bin/sh -c apt-get update')
+    'RUN'
+    >>> instruction_kind('RUN |1 TAG=latest /bin/sh -c apt-get update # buildkit')
+    'RUN'
+    >>> instruction_kind('')
+    ''
+    """
+    instruction = HISTORY_ARGS_RE.sub('', instruction)
+    words = instruction.split()
+    if words[:3] == ['/bin/sh', '-c', '#(nop)']:
+        return words[3].upper() if len(words) > 3 else ''
+    if words[:2] == ['/bin/sh', '-c']:
+        return 'RUN'
+    return words[0].upper() if words else ''
+
+
+def image_history(image: str) -> List[Tuple[str, int]]:
+    """Get (instruction, size) for each layer of `image`, from oldest to newest."""
+    output = subprocess.check_output(
+        ['docker', 'history', '--no-trunc', '--human=false', '--format', '{{json .}}', image],
+        universal_newlines=True)
+    layers = []
+    for line in output.splitlines():
+        if line.strip():
+            record = json.loads(line)
+            layers.append((record['CreatedBy'], int(record['Size'])))
+    layers.reverse()
+    return layers
+
+
+def _last_layers(history: List[Tuple[str, int]], n: int) -> List[Optional[Tuple[str, int]]]:
+    """Get the last `n` history entries created by RUN, COPY or ADD.
+
+    If there are fewer than `n`, the result is padded with ``None`` at the start.
+    """
+    layers: List[Optional[Tuple[str, int]]] = [
+        entry for entry in history if instruction_kind(entry[0]) in LAYER_INSTRUCTIONS]
+    layers = layers[-n:] if n > 0 else []
+    return [None] * (n - len(layers)) + layers
+
+
+def _same_command(instruction: str, created_by: str) -> bool:
+    a = normalise_instruction(instruction)
+    b = normalise_instruction(created_by)
+    # Build arguments may have been substituted in the history
+    return a.startswith(b) or b.startswith(a)
+
+
+def annotate(steps: Sequence[Step], current: List[Tuple[str, int]],
+             previous: Optional[List[Tuple[str, int]]]) -> List[str]:
+    """Fill in layer sizes for the steps of the final stage.
+
+    `steps` are the steps of the final stage, in order.
+
+    Returns
+    -------
+    warnings
+        Descriptions of RUN steps whose command does not match the history
+        entry they were matched to, which suggests that sizes are misattributed
+    """
+    layer_steps = [step for step in steps
+                   if instruction_kind(step.instruction) in LAYER_INSTRUCTIONS]
+    n = len(layer_steps)
+    warnings = []
+    for step, layer in zip(layer_steps, _last_layers(current, n)):
+        if layer is None:
+            continue
+        step.layer_size = layer[1]
+        if (instruction_kind(step.instruction) == 'RUN'
+                and not _same_command(step.instruction, layer[0])):
+            warnings.append(f'step {step.name} ({step.instruction[:60]}) matched to '
+                            f'layer created by {layer[0][:60]}')
+    if previous is not None:
+        for step, layer in zip(layer_steps, _last_layers(previous, n)):
+            if layer is not None:
+                step.previous_size = layer[1]
+    return warnings
+
+
+def _format_size(size: Optional[int]) -> str:
+    return '' if size is None else f'{size / 1e6:.1f} MB'
+
+
+def write_html(data: dict, filename: str) -> None:
+    rows = []
+    for step in data['steps']:
+        delta = step['size_delta']
+        rows.append(
+            '<tr><td>{}</td><td><code>{}</code></td><td>{}</td><td>{}</td><td>{}</td></tr>'.format(
+                html.escape(step['step']),
+                html.escape(step['instruction'][:200]),
+                '' if step['time'] is None else f'{step["time"]:.1f} s'
+                + (' (cached)' if step['cached'] else ''),
+                _format_size(step['layer_size']),
+                '' if delta is None else f'{delta / 1e6:+.1f} MB'))
+    summary = 'Total build time {:.1f} s; image size {}'.format(
+        data['total_time'], _format_size(data['total_size']))
+    if data['previous_total_size'] is not None:
+        summary += ' (previously {})'.format(_format_size(data['previous_total_size']))
+    with open(filename, 'w') as f:
+        f.write(f'''<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Build profile: {html.escape(data['image'])}</title></head>
+<body>
+<h1>Build profile: {html.escape(data['image'])}</h1>
+<p>{html.escape(summary)}</p>
+<table border="1">
+<tr><th>Step</th><th>Instruction</th><th>Time</th><th>Layer size</th><th>Change</th></tr>
+{chr(10).join(rows)}
+</table>
+</body>
+</html>
+''')
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Profile a Docker image build')
+    parser.add_argument('--output', '-o', required=True, help='Directory for the report')
+    parser.add_argument('--image', required=True, help='Image produced by the build')
+    parser.add_argument('--previous', help='Earlier version of the image to compare to')
+    parser.add_argument('command', nargs='+', help='Build command')
+    args = parser.parse_args(argv)
+
+    step_parser = StepParser()
+    start = time.monotonic()
+    ret = run_build(args.command, step_parser)
+    total_time = time.monotonic() - start
+
+    current = previous = None
+    if ret == 0:
+        try:
+            current = image_history(args.image)
+            if args.previous is not None:
+                previous = image_history(args.previous)
+        except (OSError, subprocess.CalledProcessError, ValueError, KeyError) as exc:
+            print(f'Warning: could not get image history: {exc}', file=sys.stderr)
+    if current is not None:
+        for warning in annotate(step_parser.final_stage(), current, previous):
+            print(f'Warning: {warning}', file=sys.stderr)
+
+    data = {
+        'image': args.image,
+        'previous': args.previous,
+        'exit_code': ret,
+        'total_time': total_time,
+        'total_size': sum(size for _, size in current) if current is not None else None,
+        'previous_total_size':
+            sum(size for _, size in previous) if previous is not None else None,
+        'steps': [step.to_dict() for step in step_parser.steps]
+    }
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, 'profile.json'), 'w') as f:
+        json.dump(data, f, indent=2)
+        f.write('\n')
+    write_html(data, os.path.join(args.output, 'profile.html'))
+
+    slowest = sorted((step for step in step_parser.steps if step.time is not None),
+                     key=lambda step: step.time or 0.0, reverse=True)[:5]
+    print(f'Build took {total_time:.1f} s; slowest steps:')
+    for step in slowest:
+        print(f'  {step.time:8.1f} s  {_format_size(step.layer_size):>10}  '
+              f'{step.instruction[:80]}')
+    return ret
+
+
+if __name__ == '__main__':
+    sys.exit(main())
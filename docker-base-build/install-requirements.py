@@ -176,7 +176,7 @@ def make_requirements(args):
     return [by_epoch[x] for x in sorted(by_epoch.keys())]
 
 
-def run_pip(args, dry_run):
+def run_pip(args, dry_run, monitor=None):
     if dry_run:
         print('pip {}'.format(' '.join(args)))
         if args != ['check']:
@@ -184,7 +184,10 @@ def run_pip(args, dry_run):
             with codecs.open(args[-1], encoding='utf-8') as f:
                 sys.stdout.write(f.read())
     else:
-        ret = subprocess.call(['pip'] + args)
+        if monitor is not None:
+            ret = monitor.run(['pip'] + args)
+        else:
+            ret = subprocess.call(['pip'] + args)
         if ret:
             sys.exit(ret)
 
@@ -203,11 +206,25 @@ def main():
     parser.add_argument(
         '--dry-run', '-n', action='store_true',
         help='Just report what would be done')
+    parser.add_argument(
+        '--timing-summary', type=int, default=0, metavar='N',
+        help='Report the N packages that took longest to install')
+    parser.add_argument(
+        '--timing-json', type=str, metavar='FILE',
+        help='Write per-package download, build and install times to FILE')
     parser.add_argument(
         'package', type=parse_requirement, nargs='*',
         help='Extra requirements')
     args, extra_args = parser.parse_known_args()
 
+    monitor = None
+    if args.timing_summary > 0 or args.timing_json:
+        # pip_timing only supports Python 3, while this script still supports 2
+        if sys.version_info < (3, 6):
+            parser.error('--timing-summary and --timing-json require Python 3.6+')
+        import pip_timing
+        monitor = pip_timing.PipMonitor()
+
     req = make_requirements(args)
     for epoch in req:
         with tempfile.NamedTemporaryFile('w', suffix='.txt') as req_file:
@@ -216,7 +233,12 @@ def main():
             req_file.flush()
             run_pip(['install',
                      '--retries', '10', '--timeout', '30',
-                     '--no-deps', '-r', req_file.name] + extra_args, args.dry_run)
+                     '--no-deps', '-r', req_file.name] + extra_args, args.dry_run, monitor)
+    if monitor is not None and not args.dry_run:
+        if args.timing_summary > 0:
+            print(monitor.summary(args.timing_summary))
+        if args.timing_json:
+            monitor.write_json(args.timing_json)
     # Check that all dependencies were found
     run_pip(['check'], args.dry_run)
 
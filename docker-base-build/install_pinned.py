@@ -11,7 +11,8 @@ constraints, in that they specify a default version but a normal requirement
 or constraint can override it by specifying a different exact version.
 
 It passes some additional arguments to ``pip`` to make it more suitable for use
-in CI/CD pipelines.
+in CI/CD pipelines, and can report the packages that took the longest to download,
+build and install (see :mod:`pip_timing`).
 """
 
 import argparse
@@ -22,7 +23,7 @@ import re
 import subprocess
 import sys
 import tempfile
-from typing import Deque, Dict, List, Sequence, Union, Generator, Iterable
+from typing import Deque, Dict, List, Optional, Sequence, Union, Generator, Iterable
 import urllib.parse
 import urllib.request
 import warnings
@@ -36,6 +37,8 @@ from pip._internal.req import InstallRequirement
 from pip._vendor.packaging.requirements import Requirement as PipRequirement
 import piptools.repositories.pypi
 
+import pip_timing
+
 
 COMMENT_RE = re.compile(r'(^|\s)+#.*$')
 RECURSIVE_FILE_RE = re.compile(r'^\s*-([rcd])\s+(.*)')
@@ -323,7 +326,8 @@ def collect_arguments(args: argparse.Namespace) -> Sequence[Union[Package, str]]
     return reqs
 
 
-def run_pip(args: List[str], dry_run: bool) -> None:
+def run_pip(args: List[str], dry_run: bool,
+            monitor: Optional[pip_timing.PipMonitor] = None) -> None:
     if dry_run:
         print('pip {}'.format(' '.join(args)))
         if args != ['check']:
@@ -331,7 +335,10 @@ def run_pip(args: List[str], dry_run: bool) -> None:
             with open(args[-1]) as f:
                 sys.stdout.write(f.read())
     else:
-        ret = subprocess.call(['pip'] + args)
+        if monitor is not None:
+            ret = monitor.run(['pip'] + args)
+        else:
+            ret = subprocess.call(['pip'] + args)
         if ret:
             sys.exit(ret)
 
@@ -350,11 +357,21 @@ def main() -> int:
     parser.add_argument(
         '--dry-run', '-n', action='store_true',
         help='Just report what would be done')
+    parser.add_argument(
+        '--timing-summary', type=int, default=0, metavar='N',
+        help='Report the N packages that took longest to install')
+    parser.add_argument(
+        '--timing-json', type=str, metavar='FILE',
+        help='Write per-package download, build and install times to FILE')
     parser.add_argument(
         'package', type=parse_requirement, nargs='*',
         help='Extra requirements')
     args, extra_args = parser.parse_known_args()
 
+    monitor = None
+    if args.timing_summary > 0 or args.timing_json:
+        monitor = pip_timing.PipMonitor()
+
     explicit_reqs = collect_arguments(args)
     try:
         reqs = resolve(explicit_reqs)
@@ -369,7 +386,12 @@ def main() -> int:
         req_file.flush()
         run_pip(['install',
                  '--retries', '10', '--timeout', '30',
-                 '--no-deps'] + extra_args + ['-r', req_file.name], args.dry_run)
+                 '--no-deps'] + extra_args + ['-r', req_file.name], args.dry_run, monitor)
+    if monitor is not None and not args.dry_run:
+        if args.timing_summary > 0:
+            print(monitor.summary(args.timing_summary))
+        if args.timing_json:
+            monitor.write_json(args.timing_json)
     # Check that all dependencies were found
     run_pip(['check'], args.dry_run)
     return 0
@@ -0,0 +1,293 @@
+"""
+Extract per-package timing information from the output of ``pip install``.
+
+pip only reports progress as unstructured log messages. :class:`PipMonitor`
+runs pip with its output piped back to us, echoes each line so that the
+console log is unchanged, and incrementally parses it to determine for each
+package
+
+- the size of the download (and whether it came from the pip cache);
+- the time spent downloading it (including looking it up in the index);
+- the time spent building it (preparing metadata, installing build
+  dependencies and building a wheel);
+- the time spent installing it.
+
+pip does not log anything while installing individual packages, so install
+times are estimated afterwards from the modification times of the
+``.dist-info`` metadata written for each package (pip installs packages in
+the order it lists them in "Installing collected packages").
+
+This is used by ``install_pinned.py`` and ``install-requirements.py`` to
+find the packages that are slowest to install, which are candidates for
+pre-building as wheels.
+"""
+
+import json
+import os
+import re
+import subprocess
+import sys
+import sysconfig
+import time
+from typing import Callable, Dict, IO, Iterable, List, Optional, Sequence, Tuple
+
+from packaging.utils import canonicalize_name
+
+
+COLLECTING_RE = re.compile(r'^Collecting (?P<name>[^\s\[<>=!~;@(]+)')
+DOWNLOADING_RE = re.compile(
+    r'^\s*(?P<kind>Downloading|Using cached) \S+ \((?P<size>[\d.]+) (?P<unit>bytes|kB|MB|GB)\)')
+PREPARING_RE = re.compile(
+    r'^\s*(Preparing metadata|Preparing wheel metadata|Installing build dependencies'
+    r'|Getting requirements to build wheel)')
+BUILDING_RE = re.compile(r'^\s*Building wheel for (?P<name>\S+) \(')
+BUILT_RE = re.compile(
+    r'^\s*(Created wheel for (?P<name>[^:\s]+):'
+    r'|Building wheel for (?P<name2>\S+) \(.*(finished with status|\.\.\. (done|error)))')
+BUILDING_WHEELS_RE = re.compile(r'^Building wheels for collected packages:')
+INSTALLING_RE = re.compile(r'^Installing collected packages: (?P<names>.*)$')
+INSTALLED_RE = re.compile(r'^Successfully installed ')
+
+UNITS = {'bytes': 1, 'kB': 10**3, 'MB': 10**6, 'GB': 10**9}
+
+
+class PackageTiming:
+    """Statistics collected for a single package."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.download_size: Optional[int] = None
+        self.cached = False
+        self.download_time = 0.0
+        self.build_time = 0.0
+        self.install_time: Optional[float] = None
+
+    @property
+    def total_time(self) -> float:
+        return self.download_time + self.build_time + (self.install_time or 0.0)
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'download_size': self.download_size,
+            'cached': self.cached,
+            'download_time': self.download_time,
+            'build_time': self.build_time,
+            'install_time': self.install_time,
+            'total_time': self.total_time
+        }
+
+
+def parse_size(size: str, unit: str) -> int:
+    """Convert a size as formatted by pip to a number of bytes.
+
+    >>> parse_size('15.7', 'MB')
+    15700000
+    """
+    return int(round(float(size) * UNITS[unit]))
+
+
+def find_metadata_times(site_dirs: Iterable[str]) -> Dict[str, float]:
+    """Find the time at which each package in `site_dirs` was installed.
+
+    This uses the modification time of the ``RECORD`` file in the
+    ``.dist-info`` directory, which pip writes after all other files of the
+    package. Packages installed with the legacy ``setup.py install`` have an
+    ``.egg-info`` directory instead, and its modification time is used.
+
+    Returns
+    -------
+    times
+        Modification times (in seconds since the epoch), indexed by
+        canonicalised package name.
+    """
+    times: Dict[str, float] = {}
+    for site_dir in site_dirs:
+        try:
+            entries = list(os.scandir(site_dir))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.name.endswith('.dist-info'):
+                path = os.path.join(entry.path, 'RECORD')
+            elif entry.name.endswith('.egg-info'):
+                path = entry.path
+            else:
+                continue
+            name = canonicalize_name(entry.name.split('-')[0])
+            try:
+                times[name] = os.stat(path).st_mtime
+            except OSError:
+                pass
+    return times
+
+
+def default_site_dirs() -> List[str]:
+    paths = sysconfig.get_paths()
+    return sorted({paths['purelib'], paths['platlib']})
+
+
+class PipMonitor:
+    """Run pip commands and collect per-package timing from the output.
+
+    Statistics accumulate over all the pip commands run through a single
+    instance, so that installations split into several pip runs produce a
+    single report.
+
+    Parameters
+    ----------
+    clock
+        Function returning the current time in seconds since the epoch. It
+        must be comparable to file modification times.
+    site_dirs
+        Directories in which to find package metadata to estimate install
+        times. If not specified, they are determined from the running
+        interpreter, which is assumed to share an environment with ``pip``.
+    """
+
+    def __init__(self, *, clock: Callable[[], float] = time.time,
+                 site_dirs: Optional[Sequence[str]] = None) -> None:
+        self.clock = clock
+        self.site_dirs = list(site_dirs) if site_dirs is not None else default_site_dirs()
+        self.packages: Dict[str, PackageTiming] = {}
+        self.total_time = 0.0
+        # Phase currently being timed: package name, phase and start time
+        self._current: Optional[Tuple[str, str, float]] = None
+        self._collecting: Optional[str] = None
+        self._install_order: List[str] = []
+        self._install_start: Optional[float] = None
+
+    def _package(self, name: str) -> PackageTiming:
+        name = canonicalize_name(name)
+        if name not in self.packages:
+            self.packages[name] = PackageTiming(name)
+        return self.packages[name]
+
+    def _finish_phase(self, now: float) -> None:
+        if self._current is not None:
+            name, phase, start = self._current
+            pkg = self._package(name)
+            if phase == 'download':
+                pkg.download_time += now - start
+            else:
+                pkg.build_time += now - start
+            self._current = None
+
+    def _start_phase(self, name: str, phase: str, now: float) -> None:
+        self._finish_phase(now)
+        self._current = (name, phase, now)
+
+    def feed(self, line: str, now: Optional[float] = None) -> None:
+        """Process a single line of pip output."""
+        if now is None:
+            now = self.clock()
+        match = COLLECTING_RE.match(line)
+        if match:
+            self._collecting = match.group('name')
+            self._start_phase(self._collecting, 'download', now)
+            return
+        match = DOWNLOADING_RE.match(line)
+        if match and self._collecting is not None:
+            pkg = self._package(self._collecting)
+            pkg.download_size = parse_size(match.group('size'), match.group('unit'))
+            pkg.cached = (match.group('kind') == 'Using cached')
+            return
+        if PREPARING_RE.match(line) and self._collecting is not None:
+            if self._current is None or self._current[1] != 'build':
+                self._start_phase(self._collecting, 'build', now)
+            return
+        match = BUILT_RE.match(line)
+        if match:
+            self._finish_phase(now)
+            return
+        match = BUILDING_RE.match(line)
+        if match:
+            self._collecting = None
+            self._start_phase(match.group('name'), 'build', now)
+            return
+        if BUILDING_WHEELS_RE.match(line):
+            self._collecting = None
+            self._finish_phase(now)
+            return
+        match = INSTALLING_RE.match(line)
+        if match:
+            self._collecting = None
+            self._finish_phase(now)
+            self._install_order = [name.strip() for name in match.group('names').split(',')]
+            self._install_start = now
+            return
+        if INSTALLED_RE.match(line):
+            self._finish_phase(now)
+            self._collect_install_times()
+
+    def _collect_install_times(self) -> None:
+        if self._install_start is None:
+            return
+        times = find_metadata_times(self.site_dirs)
+        prev = self._install_start
+        for name in self._install_order:
+            pkg = self._package(name)
+            finished = times.get(pkg.name)
+            # Allow for filesystems with coarse timestamps
+            if finished is not None and finished >= prev - 1.0:
+                pkg.install_time = max(finished - prev, 0.0)
+                prev = max(finished, prev)
+        self._install_order = []
+        self._install_start = None
+
+    def run(self, args: Sequence[str], output: IO[str] = sys.stdout) -> int:
+        """Run a command, echoing its output to `output` while parsing it.
+
+        Returns
+        -------
+        returncode
+            The exit code of the command
+        """
+        start = self.clock()
+        with subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                              encoding='utf-8', errors='replace', bufsize=1) as proc:
+            assert proc.stdout is not None
+            for line in proc.stdout:
+                output.write(line)
+                output.flush()
+                self.feed(line.rstrip('\n'))
+        self._finish_phase(self.clock())
+        self.total_time += self.clock() - start
+        return proc.returncode
+
+    def slowest(self, n: Optional[int] = None) -> List[PackageTiming]:
+        """Get the `n` packages that took the longest (or all, if `n` is None)."""
+        pkgs = sorted(self.packages.values(), key=lambda pkg: pkg.total_time, reverse=True)
+        return pkgs if n is None else pkgs[:n]
+
+    def summary(self, n: int) -> str:
+        """Format a table of the `n` slowest packages."""
+        def format_time(value: Optional[float]) -> str:
+            return '-' if value is None else f'{value:.1f}'
+
+        lines = [
+            f'Slowest {min(n, len(self.packages))} of {len(self.packages)} packages '
+            f'(times in seconds, total {self.total_time:.1f}):',
+            f'{"Package":30} {"Size (MB)":>10} {"Download":>9} {"Build":>9} '
+            f'{"Install":>9} {"Total":>9}'
+        ]
+        for pkg in self.slowest(n):
+            if pkg.download_size is None:
+                size = '-'
+            else:
+                size = f'{pkg.download_size / 1e6:.1f}' + (' (c)' if pkg.cached else '')
+            lines.append(
+                f'{pkg.name:30} {size:>10} {format_time(pkg.download_time):>9} '
+                f'{format_time(pkg.build_time):>9} {format_time(pkg.install_time):>9} '
+                f'{format_time(pkg.total_time):>9}')
+        return '\n'.join(lines)
+
+    def write_json(self, filename: str) -> None:
+        """Write the statistics for all packages to `filename`."""
+        data = {
+            'total_time': self.total_time,
+            'packages': [pkg.to_dict() for pkg in self.slowest()]
+        }
+        with open(filename, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.write('\n')
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Reduce the size of a virtual environment after everything has been installed
+into it. This is intended to be run as the last step before a virtual
+environment is copied into a runtime image. It
+
+- removes test suites (``tests`` and ``test`` directories inside packages);
+- strips debug symbols from shared libraries;
+- compiles all modules to bytecode (in parallel) at a single optimisation
+  level, removing bytecode for other optimisation levels;
+- replaces identical files with hard links to a single copy.
+
+Each of these steps can be disabled. Packages can be excluded from
+processing with ``--exclude``, or processing can be restricted to specific
+packages with ``--include``; both take canonical package names, which may
+contain shell-style wildcards. Some packages import their own tests at run
+time and are never stripped of their tests (see :data:`KEEP_TESTS`).
+
+Finally, it reports the disk space saved for each package.
+"""
+
+import argparse
+import compileall
+import concurrent.futures
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from packaging.utils import canonicalize_name
+
+
+#: Directory names that are removed as test suites
+TEST_DIRS = frozenset(['tests', 'test'])
+#: Packages whose ``tests`` directories are needed at run time
+KEEP_TESTS = frozenset([
+    'astropy',      # astropy/__init__.py imports astropy.tests.runner
+])
+#: Name used in reports for files not belonging to any installed package
+UNOWNED = '<unowned>'
+ELF_MAGIC = b'\x7fELF'
+
+
+class Policy:
+    """Decides which packages may be modified."""
+
+    def __init__(self, include: Sequence[str] = (), exclude: Sequence[str] = ()) -> None:
+        self.include = [canonicalize_name(pattern) for pattern in include]
+        self.exclude = [canonicalize_name(pattern) for pattern in exclude]
+
+    def allowed(self, owner: str) -> bool:
+        if any(fnmatch.fnmatchcase(owner, pattern) for pattern in self.exclude):
+            return False
+        if self.include:
+            return any(fnmatch.fnmatchcase(owner, pattern) for pattern in self.include)
+        return True
+
+
+class Ownership:
+    """Map files in a virtual environment to the packages that installed them.
+
+    Ownership is determined from the ``RECORD`` files of the installed
+    distributions. Files not listed there (such as bytecode compiled after
+    installation) are assigned to the owner of the closest directory
+    containing files from a single package. Directories shared by several
+    packages (such as namespace packages) are skipped in favour of their
+    parents.
+    """
+
+    def __init__(self, site_packages: str) -> None:
+        self.files: Dict[str, str] = {}
+        self.dirs: Dict[str, Optional[str]] = {}    # None if shared by several packages
+        for record in glob.glob(os.path.join(site_packages, '*.dist-info', 'RECORD')):
+            dist_info = os.path.basename(os.path.dirname(record))
+            owner = canonicalize_name(dist_info.split('-')[0])
+            with open(record) as f:
+                for line in f:
+                    rel_path = line.rsplit(',', 2)[0]
+                    if not rel_path:
+                        continue
+                    path = os.path.normpath(os.path.join(site_packages, rel_path))
+                    self.files[path] = owner
+                    parent = os.path.dirname(path)
+                    while parent.startswith(site_packages + os.sep):
+                        if self.dirs.setdefault(parent, owner) != owner:
+                            self.dirs[parent] = None
+                        parent = os.path.dirname(parent)
+
+    def owner(self, path: str) -> str:
+        path = os.path.normpath(path)
+        if path in self.files:
+            return self.files[path]
+        parent = os.path.dirname(path)
+        while parent != os.path.dirname(parent):
+            owner = self.dirs.get(parent)
+            if owner is not None:
+                return owner
+            parent = os.path.dirname(parent)
+        return UNOWNED
+
+
+def find_site_packages(venv: str) -> str:
+    candidates = glob.glob(os.path.join(venv, 'lib', 'python*', 'site-packages'))
+    if len(candidates) != 1:
+        raise RuntimeError(f'Expected exactly one site-packages directory in {venv}')
+    return candidates[0]
+
+
+def walk_files(root: str) -> Iterator[os.DirEntry]:
+    """Recursively yield all regular files (not symlinks) under `root`."""
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+def measure(venv: str, ownership: Ownership) -> Dict[str, int]:
+    """Compute disk usage per package.
+
+    Each inode is counted only once, against the first path found for it.
+    """
+    usage: Dict[str, int] = {}
+    seen: Set[Tuple[int, int]] = set()
+    for entry in walk_files(venv):
+        st = entry.stat(follow_symlinks=False)
+        if (st.st_dev, st.st_ino) in seen:
+            continue
+        seen.add((st.st_dev, st.st_ino))
+        owner = ownership.owner(entry.path)
+        usage[owner] = usage.get(owner, 0) + st.st_blocks * 512
+    return usage
+
+
+def remove_tests(site_packages: str, ownership: Ownership, policy: Policy) -> None:
+    # Only directories inside a package are considered, not top-level modules
+    stack = [entry.path for entry in os.scandir(site_packages)
+             if entry.is_dir(follow_symlinks=False)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if not entry.is_dir(follow_symlinks=False):
+                    continue
+                if entry.name in TEST_DIRS:
+                    owner = ownership.owner(os.path.join(entry.path, '__init__.py'))
+                    if owner not in KEEP_TESTS and policy.allowed(owner):
+                        shutil.rmtree(entry.path)
+                        continue
+                stack.append(entry.path)
+
+
+def is_elf(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(ELF_MAGIC)) == ELF_MAGIC
+
+
+def strip_libraries(venv: str, ownership: Ownership, policy: Policy, jobs: int) -> None:
+    libraries = [
+        entry.path for entry in walk_files(venv)
+        if (entry.name.endswith('.so') or '.so.' in entry.name)
+        and policy.allowed(ownership.owner(entry.path))
+        and is_elf(entry.path)
+    ]
+    with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+        for path, ret in zip(libraries, pool.map(
+                lambda path: subprocess.call(['strip', '--strip-debug', '--', path]),
+                libraries)):
+            if ret:
+                print(f'Warning: could not strip {path}', file=sys.stderr)
+
+
+def _bytecode_level(name: str) -> int:
+    """Get the optimisation level from a bytecode filename.
+
+    >>> _bytecode_level('foo.cpython-38.pyc')
+    0
+    >>> _bytecode_level('foo.cpython-38.opt-2.pyc')
+    2
+    """
+    tag = name[:-len('.pyc')].rsplit('.', 1)[-1]
+    return int(tag[len('opt-'):]) if tag.startswith('opt-') else 0
+
+
+def _compile_file(path: str, optimize: int) -> bool:
+    return compileall.compile_file(path, quiet=1, optimize=optimize)
+
+
+def compile_bytecode(site_packages: str, ownership: Ownership, policy: Policy,
+                     optimize: int, jobs: int) -> None:
+    for entry in list(walk_files(site_packages)):
+        if (entry.name.endswith('.pyc')
+                and os.path.basename(os.path.dirname(entry.path)) == '__pycache__'
+                and _bytecode_level(entry.name) != optimize
+                and policy.allowed(ownership.owner(entry.path))):
+            os.remove(entry.path)
+    if not policy.include and not policy.exclude:
+        compileall.compile_dir(site_packages, quiet=1, optimize=optimize, workers=jobs)
+    else:
+        # compile_dir can only compile whole trees, so compile per file
+        sources = [entry.path for entry in walk_files(site_packages)
+                   if entry.name.endswith('.py')
+                   and policy.allowed(ownership.owner(entry.path))]
+        with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+            list(pool.map(_compile_file, sources, [optimize] * len(sources), chunksize=64))
+
+
+def _hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hardlink_duplicates(venv: str, ownership: Ownership, policy: Policy, jobs: int) -> None:
+    by_size: Dict[Tuple[int, int], List[os.DirEntry]] = {}
+    for entry in walk_files(venv):
+        st = entry.stat(follow_symlinks=False)
+        if st.st_size > 0 and policy.allowed(ownership.owner(entry.path)):
+            by_size.setdefault((st.st_dev, st.st_size), []).append(entry)
+    candidates = [entry.path for group in by_size.values() if len(group) > 1
+                  for entry in group]
+    with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+        hashes = dict(zip(candidates, pool.map(_hash_file, candidates)))
+    first: Dict[Tuple[int, int, str], str] = {}
+    for (dev, size), group in by_size.items():
+        for entry in group:
+            if entry.path not in hashes:
+                continue
+            key = (dev, size, hashes[entry.path])
+            if key not in first:
+                first[key] = entry.path
+                continue
+            target = first[key]
+            target_st = os.stat(target)
+            st = entry.stat(follow_symlinks=False)
+            if st.st_ino == target_st.st_ino or st.st_mode != target_st.st_mode:
+                continue
+            tmp_path = entry.path + '.slim-venv-tmp'
+            os.link(target, tmp_path)
+            os.replace(tmp_path, entry.path)
+
+
+def format_report(before: Dict[str, int], after: Dict[str, int]) -> str:
+    saved = {owner: before.get(owner, 0) - after.get(owner, 0) for owner in before}
+    total_before = sum(before.values())
+    total_saved = sum(saved.values())
+    lines = [f'{"Package":30} {"Before (MB)":>12} {"Saved (MB)":>12}']
+    for owner in sorted(saved, key=lambda owner: saved[owner], reverse=True):
+        if saved[owner]:
+            lines.append(f'{owner:30} {before[owner] / 1e6:12.1f} {saved[owner] / 1e6:12.1f}')
+    lines.append(f'{"Total":30} {total_before / 1e6:12.1f} {total_saved / 1e6:12.1f}')
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Reduce the size of a virtual environment')
+    parser.add_argument(
+        'venv', nargs='?', default=os.environ.get('VIRTUAL_ENV'),
+        help='Virtual environment to slim [$VIRTUAL_ENV]')
+    parser.add_argument(
+        '--include', action='append', default=[], metavar='PACKAGE',
+        help='Only modify files belonging to this package (may be repeated)')
+    parser.add_argument(
+        '--exclude', action='append', default=[], metavar='PACKAGE',
+        help='Do not modify files belonging to this package (may be repeated)')
+    parser.add_argument(
+        '--no-remove-tests', dest='remove_tests', action='store_false',
+        help='Keep test suites')
+    parser.add_argument(
+        '--no-strip', dest='strip', action='store_false',
+        help='Do not strip shared libraries')
+    parser.add_argument(
+        '--no-compile', dest='compile', action='store_false',
+        help='Do not (re)compile bytecode')
+    parser.add_argument(
+        '--optimize', type=int, choices=[0, 1, 2], default=0,
+        help='Optimisation level for bytecode [%(default)s]')
+    parser.add_argument(
+        '--no-hardlink', dest='hardlink', action='store_false',
+        help='Do not replace identical files with hard links')
+    parser.add_argument(
+        '--jobs', '-j', type=int, default=os.cpu_count(),
+        help='Number of parallel jobs [%(default)s]')
+    parser.add_argument(
+        '--report', metavar='FILE',
+        help='Write per-package sizes before and after to FILE as JSON')
+    args = parser.parse_args(argv)
+    if args.venv is None:
+        parser.error('no virtual environment specified and $VIRTUAL_ENV is not set')
+
+    venv = os.path.abspath(args.venv)
+    site_packages = find_site_packages(venv)
+    ownership = Ownership(site_packages)
+    policy = Policy(args.include, args.exclude)
+
+    before = measure(venv, ownership)
+    if args.remove_tests:
+        remove_tests(site_packages, ownership, policy)
+    if args.strip:
+        strip_libraries(venv, ownership, policy, args.jobs)
+    if args.compile:
+        compile_bytecode(site_packages, ownership, policy, args.optimize, args.jobs)
+    if args.hardlink:
+        hardlink_duplicates(venv, ownership, policy, args.jobs)
+    after = measure(venv, ownership)
+
+    print(format_report(before, after))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'before': before, 'after': after}, f, indent=2, sort_keys=True)
+            f.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+import io
+import json
+import os
+import sys
+from typing import List, Tuple
+
+import pytest
+
+import pip_timing
+from pip_timing import PipMonitor
+
+
+@pytest.mark.parametrize(
+    'size, unit, result',
+    [
+        ('123', 'bytes', 123),
+        ('1.5', 'kB', 1500),
+        ('15.7', 'MB', 15700000),
+        ('2', 'GB', 2000000000)
+    ]
+)
+def test_parse_size(size: str, unit: str, result: int) -> None:
+    assert pip_timing.parse_size(size, unit) == result
+
+
+def _feed(monitor: PipMonitor, lines: List[Tuple[float, str]]) -> None:
+    for now, line in lines:
+        monitor.feed(line, now)
+
+
+def test_download_and_build(tmp_path) -> None:
+    monitor = PipMonitor(site_dirs=[str(tmp_path)])
+    _feed(monitor, [
+        (100.0, 'Collecting numpy==1.21.4'),
+        (100.5, '  Downloading numpy-1.21.4-cp38-cp38-manylinux2010_x86_64.whl (15.7 MB)'),
+        (103.0, 'Collecting Foo_Bar[test]==1.0 (from -r /tmp/req.txt (line 2))'),
+        (103.5, '  Using cached Foo_Bar-1.0.tar.gz (12 kB)'),
+        (104.0, "  Preparing metadata (setup.py): started"),
+        (106.0, "  Preparing metadata (setup.py): finished with status 'done'"),
+        (106.5, 'Building wheels for collected packages: Foo-Bar'),
+        (107.0, '  Building wheel for Foo-Bar (setup.py): started'),
+        (117.0, "  Building wheel for Foo-Bar (setup.py): finished with status 'done'"),
+        (117.0, '  Created wheel for Foo-Bar: filename=Foo_Bar-1.0-py3-none-any.whl size=1234'),
+        (117.5, 'Successfully built Foo-Bar')
+    ])
+    numpy = monitor.packages['numpy']
+    assert numpy.download_size == 15700000
+    assert not numpy.cached
+    assert numpy.download_time == pytest.approx(3.0)
+    assert numpy.build_time == 0.0
+    foo = monitor.packages['foo-bar']
+    assert foo.download_size == 12000
+    assert foo.cached
+    assert foo.download_time == pytest.approx(1.0)
+    assert foo.build_time == pytest.approx(12.5)
+    assert [pkg.name for pkg in monitor.slowest()] == ['foo-bar', 'numpy']
+
+
+def test_install_times(tmp_path) -> None:
+    for name, mtime in [('numpy', 205.0), ('Foo_Bar', 202.0)]:
+        dist_info = tmp_path / f'{name}-1.0.dist-info'
+        dist_info.mkdir()
+        (dist_info / 'RECORD').write_text('')
+        os.utime(dist_info / 'RECORD', (mtime, mtime))
+    monitor = PipMonitor(site_dirs=[str(tmp_path)])
+    _feed(monitor, [
+        (200.0, 'Installing collected packages: Foo-Bar, numpy, missing'),
+        (206.0, 'Successfully installed Foo-Bar-1.0 numpy-1.0 missing-1.0')
+    ])
+    assert monitor.packages['foo-bar'].install_time == pytest.approx(2.0)
+    assert monitor.packages['numpy'].install_time == pytest.approx(3.0)
+    assert monitor.packages['missing'].install_time is None
+
+
+def test_find_metadata_times(tmp_path) -> None:
+    (tmp_path / 'foo-1.0.dist-info').mkdir()
+    (tmp_path / 'foo-1.0.dist-info' / 'RECORD').write_text('')
+    os.utime(tmp_path / 'foo-1.0.dist-info' / 'RECORD', (10.0, 10.0))
+    (tmp_path / 'Bar-2.0-py3.8.egg-info').mkdir()
+    os.utime(tmp_path / 'Bar-2.0-py3.8.egg-info', (20.0, 20.0))
+    (tmp_path / 'foo').mkdir()
+    times = pip_timing.find_metadata_times([str(tmp_path), str(tmp_path / 'missing')])
+    assert times == {'foo': 10.0, 'bar': 20.0}
+
+
+def test_run(tmp_path) -> None:
+    script = 'print("Collecting foo==1.0"); print("  Downloading foo-1.0.tar.gz (5 kB)")'
+    output = io.StringIO()
+    monitor = PipMonitor(site_dirs=[str(tmp_path)])
+    ret = monitor.run([sys.executable, '-c', script], output)
+    assert ret == 0
+    assert output.getvalue() == 'Collecting foo==1.0\n  Downloading foo-1.0.tar.gz (5 kB)\n'
+    assert monitor.packages['foo'].download_size == 5000
+
+
+def test_run_invalid_utf8(tmp_path) -> None:
+    script = 'import sys; sys.stdout.buffer.write(b"caf\\xe9\\nCollecting foo==1.0\\n")'
+    output = io.StringIO()
+    monitor = PipMonitor(site_dirs=[str(tmp_path)])
+    assert monitor.run([sys.executable, '-c', script], output) == 0
+    assert output.getvalue() == 'caf\ufffd\nCollecting foo==1.0\n'
+    assert 'foo' in monitor.packages
+
+
+def test_summary_and_json(tmp_path) -> None:
+    monitor = PipMonitor(site_dirs=[str(tmp_path)])
+    _feed(monitor, [
+        (0.0, 'Collecting foo==1.0'),
+        (0.0, '  Downloading foo-1.0.tar.gz (2.5 MB)'),
+        (4.0, 'Collecting bar==1.0'),
+        (5.0, 'Building wheels for collected packages: foo')
+    ])
+    summary = monitor.summary(1)
+    assert summary.splitlines()[0].startswith('Slowest 1 of 2 packages')
+    assert summary.splitlines()[2].split() == ['foo', '2.5', '4.0', '0.0', '-', '4.0']
+
+    filename = tmp_path / 'timing.json'
+    monitor.write_json(str(filename))
+    data = json.loads(filename.read_text())
+    assert [pkg['name'] for pkg in data['packages']] == ['foo', 'bar']
+    assert data['packages'][1]['download_time'] == 1.0
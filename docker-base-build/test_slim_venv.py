@@ -0,0 +1,140 @@
+import json
+import os
+import pathlib
+
+import pytest
+
+import slim_venv
+from slim_venv import Ownership, Policy
+
+
+@pytest.fixture
+def venv(tmp_path) -> pathlib.Path:
+    """Create a fake virtual environment with two packages."""
+    site_packages = tmp_path / 'lib' / 'python3.8' / 'site-packages'
+    files = {
+        'foo/__init__.py': 'import foo.core\n',
+        'foo/core.py': 'VALUE = 1\n',
+        'foo/LICENSE': 'License text\n' * 100,
+        'foo/tests/__init__.py': '',
+        'foo/tests/test_core.py': 'def test_value():\n    pass\n' * 1000,
+        'foo/__pycache__/core.cpython-38.opt-1.pyc': 'bytecode',
+        'astropy/__init__.py': 'from .tests import runner\n',
+        'astropy/LICENSE': 'License text\n' * 100,
+        'astropy/tests/__init__.py': '',
+        'astropy/tests/runner.py': '',
+        'stray.py': 'pass\n'
+    }
+    for name, content in files.items():
+        path = site_packages / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+    for dist, pkg in [('foo-1.0', 'foo'), ('astropy-4.3', 'astropy')]:
+        dist_info = site_packages / f'{dist}.dist-info'
+        dist_info.mkdir()
+        record = [f'{name},,' for name in files if name.startswith(pkg + '/')]
+        record.append(f'{dist}.dist-info/RECORD,,')
+        (dist_info / 'RECORD').write_text('\n'.join(record) + '\n')
+    (tmp_path / 'bin').mkdir()
+    (tmp_path / 'bin' / 'python').symlink_to('/usr/bin/python3')
+    return tmp_path
+
+
+def _site_packages(venv: pathlib.Path) -> pathlib.Path:
+    return venv / 'lib' / 'python3.8' / 'site-packages'
+
+
+def test_ownership(venv) -> None:
+    site_packages = _site_packages(venv)
+    ownership = Ownership(str(site_packages))
+    assert ownership.owner(str(site_packages / 'foo' / 'core.py')) == 'foo'
+    assert ownership.owner(str(site_packages / 'foo' / '__pycache__' / 'new.pyc')) == 'foo'
+    assert ownership.owner(str(site_packages / 'astropy-4.3.dist-info' / 'RECORD')) == 'astropy'
+    assert ownership.owner(str(site_packages / 'stray.py')) == slim_venv.UNOWNED
+
+
+def test_ownership_shared_directory(tmp_path) -> None:
+    for dist, name in [('ns_a-1.0', 'a.py'), ('ns_b-1.0', 'b.py')]:
+        (tmp_path / 'ns' / 'sub').mkdir(parents=True, exist_ok=True)
+        (tmp_path / 'ns' / 'sub' / name).write_text('')
+        dist_info = tmp_path / f'{dist}.dist-info'
+        dist_info.mkdir()
+        (dist_info / 'RECORD').write_text(f'ns/sub/{name},,\nns/{dist}.txt,,\n')
+    ownership = Ownership(str(tmp_path))
+    assert ownership.owner(str(tmp_path / 'ns' / 'sub' / 'a.py')) == 'ns-a'
+    assert ownership.owner(str(tmp_path / 'ns' / 'sub' / 'a.pyc')) == slim_venv.UNOWNED
+    assert ownership.owner(str(tmp_path / 'ns' / 'other.py')) == slim_venv.UNOWNED
+
+
+def test_policy() -> None:
+    policy = Policy(exclude=['Foo_Bar'])
+    assert not policy.allowed('foo-bar')
+    assert policy.allowed('baz')
+    policy = Policy(include=['foo-*'], exclude=['foo-bar'])
+    assert not policy.allowed('foo-bar')
+    assert policy.allowed('foo-baz')
+    assert not policy.allowed('baz')
+
+
+def test_remove_tests(venv) -> None:
+    site_packages = _site_packages(venv)
+    slim_venv.remove_tests(str(site_packages), Ownership(str(site_packages)), Policy())
+    assert not (site_packages / 'foo' / 'tests').exists()
+    assert (site_packages / 'foo' / 'core.py').exists()
+    # Excluded by KEEP_TESTS
+    assert (site_packages / 'astropy' / 'tests' / 'runner.py').exists()
+
+
+def test_remove_tests_excluded(venv) -> None:
+    site_packages = _site_packages(venv)
+    slim_venv.remove_tests(str(site_packages), Ownership(str(site_packages)),
+                           Policy(exclude=['foo']))
+    assert (site_packages / 'foo' / 'tests').exists()
+
+
+def test_compile_bytecode(venv) -> None:
+    site_packages = _site_packages(venv)
+    slim_venv.compile_bytecode(str(site_packages), Ownership(str(site_packages)), Policy(),
+                               0, 2)
+    pycache = site_packages / 'foo' / '__pycache__'
+    names = {path.name for path in pycache.iterdir()}
+    assert not any('.opt-' in name for name in names)
+    assert any(name.startswith('core.') for name in names)
+
+
+def test_compile_bytecode_policy(venv) -> None:
+    site_packages = _site_packages(venv)
+    slim_venv.compile_bytecode(str(site_packages), Ownership(str(site_packages)),
+                               Policy(include=['astropy']), 2, 2)
+    assert (site_packages / 'foo' / '__pycache__' / 'core.cpython-38.opt-1.pyc').exists()
+    assert not (site_packages / 'foo' / '__pycache__' / '__init__.cpython-38.opt-2.pyc').exists()
+    names = {path.name for path in (site_packages / 'astropy' / '__pycache__').iterdir()}
+    assert all(name.endswith('.opt-2.pyc') for name in names)
+
+
+def test_hardlink_duplicates(venv) -> None:
+    site_packages = _site_packages(venv)
+    slim_venv.hardlink_duplicates(str(venv), Ownership(str(site_packages)), Policy(), 2)
+    foo_license = site_packages / 'foo' / 'LICENSE'
+    astropy_license = site_packages / 'astropy' / 'LICENSE'
+    assert os.path.samefile(foo_license, astropy_license)
+    assert astropy_license.read_text() == 'License text\n' * 100
+    assert not os.path.samefile(site_packages / 'foo' / 'core.py',
+                                site_packages / 'stray.py')
+
+
+def test_is_elf(tmp_path) -> None:
+    (tmp_path / 'text.so').write_text('not a library')
+    assert not slim_venv.is_elf(str(tmp_path / 'text.so'))
+    (tmp_path / 'lib.so').write_bytes(b'\x7fELF\x02\x01\x01')
+    assert slim_venv.is_elf(str(tmp_path / 'lib.so'))
+
+
+def test_main(venv, capsys) -> None:
+    report = venv / 'report.json'
+    assert slim_venv.main([str(venv), '--no-strip', '--report', str(report)]) == 0
+    assert not (_site_packages(venv) / 'foo' / 'tests').exists()
+    data = json.loads(report.read_text())
+    assert set(data) == {'before', 'after'}
+    assert data['after']['foo'] < data['before']['foo']
+    assert capsys.readouterr().out.splitlines()[-1].startswith('Total')
@@ -0,0 +1,76 @@
+import errno
+import os
+import pathlib
+import subprocess
+import venv
+
+import pytest
+
+import venv_template
+
+
+@pytest.fixture
+def template(tmp_path) -> pathlib.Path:
+    path = tmp_path / 'template'
+    venv.create(str(path), symlinks=True)
+    script = path / 'bin' / 'hello'
+    script.write_text(f'#!{path}/bin/python\nimport sys\nprint(sys.prefix)\n')
+    script.chmod(0o755)
+    (path / 'bin' / 'linked').symlink_to(path / 'bin' / 'hello')
+    (path / 'module.py').write_text('VALUE = 1\n')
+    venv_template.write_marker(str(path))
+    return path
+
+
+@pytest.mark.parametrize('mode', ['reflink', 'hardlink', 'copy'])
+def test_clone(tmp_path, template, mode: str) -> None:
+    dest = tmp_path / 'dest'
+    venv_template.clone(str(template), str(dest), mode)
+    assert not (dest / venv_template.MARKER).exists()
+    assert (dest / 'bin' / 'hello').read_text().startswith(f'#!{dest}/bin/python\n')
+    assert os.readlink(dest / 'bin' / 'linked') == str(dest / 'bin' / 'hello')
+    assert str(template) not in (dest / 'bin' / 'activate').read_text()
+    # The template must not be modified
+    assert (template / 'bin' / 'hello').read_text().startswith(f'#!{template}/bin/python\n')
+    output = subprocess.check_output([str(dest / 'bin' / 'hello')], universal_newlines=True)
+    assert output.strip() == str(dest)
+
+
+def test_clone_hardlink(tmp_path, template) -> None:
+    dest = tmp_path / 'dest'
+    venv_template.clone(str(template), str(dest), 'hardlink')
+    assert os.path.samefile(template / 'module.py', dest / 'module.py')
+    assert not os.path.samefile(template / 'bin' / 'activate', dest / 'bin' / 'activate')
+
+
+def test_clone_not_template(tmp_path) -> None:
+    with pytest.raises(RuntimeError, match='not a virtual environment template'):
+        venv_template.clone(str(tmp_path), str(tmp_path / 'dest'))
+
+
+def test_clone_exists(tmp_path, template) -> None:
+    (tmp_path / 'dest').mkdir()
+    with pytest.raises(FileExistsError):
+        venv_template.clone(str(template), str(tmp_path / 'dest'))
+
+
+def test_copier_fallback(tmp_path, mocker) -> None:
+    src = tmp_path / 'src'
+    src.write_text('hello')
+    mocker.patch('os.link', side_effect=OSError(errno.EXDEV, 'Cross-device'))
+    copier = venv_template.Copier('hardlink')
+    copier(str(src), str(tmp_path / 'dst'))
+    assert copier.mode == 'copy'
+    assert (tmp_path / 'dst').read_text() == 'hello'
+    assert not os.path.samefile(src, tmp_path / 'dst')
+
+
+def test_main_create(tmp_path, mocker) -> None:
+    check_call = mocker.patch('subprocess.check_call')
+    path = tmp_path / 'template'
+    path.mkdir()
+    assert venv_template.main(['create', '-r', 'pre-requirements.txt', str(path)]) == 0
+    check_call.assert_any_call(['virtualenv', '-p', '/usr/bin/python3', str(path)])
+    check_call.assert_any_call([str(path / 'bin' / 'pip'), 'install',
+                                '-r', 'pre-requirements.txt'])
+    assert venv_template.read_marker(str(path)) == str(path)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Create virtual environments by cloning a template.
+
+Creating a virtual environment with ``virtualenv`` and then installing the
+bootstrap packages (pip, setuptools, wheel, pip-tools etc.) into it takes
+tens of seconds, and the Dockerfiles do it several times. Instead, the
+bootstrap environment is built once with ``create``, and new environments
+are made from it with ``clone``, which copies the tree and rewrites the
+few files that contain the absolute path of the environment (activation
+scripts and the shebang lines of installed scripts).
+
+Files are copied with copy-on-write clones where the filesystem supports
+them (``--mode reflink``, the default, which falls back to an ordinary
+copy), or can be hard-linked to the template (``--mode hardlink``). Hard
+links are only safe if nothing modifies installed files in place, since
+the change would also affect the template and other clones; pip replaces
+files rather than modifying them, so upgrading packages is safe.
+"""
+
+import argparse
+import errno
+import fcntl
+import json
+import os
+import shutil
+import subprocess
+import sys
+from typing import List, Optional, Sequence
+
+
+#: Name of the file in the template recording the path at which it was created
+MARKER = '.venv-template.json'
+#: ioctl to clone a file on filesystems supporting copy-on-write (from linux/fs.h)
+FICLONE = 0x40049409
+#: Errors indicating that a reflink or hard link is not possible, so fall back to a copy
+FALLBACK_ERRNOS = frozenset([errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL,
+                             errno.EPERM, errno.EMLINK])
+
+
+def create_template(path: str, python: str, requirements: Sequence[str]) -> None:
+    """Create a template virtual environment and install `requirements` into it."""
+    path = os.path.abspath(path)
+    subprocess.check_call(['virtualenv', '-p', python, path])
+    if requirements:
+        args = [os.path.join(path, 'bin', 'pip'), 'install']
+        for requirement in requirements:
+            args.extend(['-r', requirement])
+        subprocess.check_call(args)
+    write_marker(path)
+
+
+def write_marker(path: str) -> None:
+    with open(os.path.join(path, MARKER), 'w') as f:
+        json.dump({'prefix': path}, f)
+        f.write('\n')
+
+
+def read_marker(path: str) -> str:
+    """Get the path at which the template at `path` was created."""
+    try:
+        with open(os.path.join(path, MARKER)) as f:
+            return json.load(f)['prefix']
+    except FileNotFoundError:
+        raise RuntimeError(f'{path} is not a virtual environment template') from None
+
+
+class Copier:
+    """Copy files by reflink, hard link or plain copy.
+
+    If a reflink or hard link fails because the filesystem does not support
+    it, a plain copy is made instead and the faster method is not attempted
+    again.
+    """
+
+    def __init__(self, mode: str) -> None:
+        if mode not in {'reflink', 'hardlink', 'copy'}:
+            raise ValueError(f'Unknown mode {mode!r}')
+        self.mode = mode
+
+    def _reflink(self, src: str, dst: str) -> None:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+
+    def __call__(self, src: str, dst: str) -> None:
+        try:
+            if self.mode == 'reflink':
+                self._reflink(src, dst)
+                return
+            elif self.mode == 'hardlink':
+                os.link(src, dst)
+                return
+        except OSError as exc:
+            if exc.errno not in FALLBACK_ERRNOS:
+                raise
+            self.mode = 'copy'
+        shutil.copy2(src, dst)
+
+
+def _rewrite(path: str, old: bytes, new: bytes) -> None:
+    """Replace `old` with `new` in `path`, if it occurs.
+
+    The file is replaced rather than modified in place, so that it is safe
+    to use on hard links.
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+    if old not in content:
+        return
+    tmp_path = path + '.venv-template-tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(content.replace(old, new))
+    shutil.copymode(path, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def clone(template: str, dest: str, mode: str = 'reflink') -> None:
+    """Create a virtual environment at `dest` from `template`."""
+    template = os.path.abspath(template)
+    dest = os.path.abspath(dest)
+    prefix = read_marker(template)
+    if os.path.lexists(dest):
+        raise FileExistsError(errno.EEXIST, 'Destination already exists', dest)
+    shutil.copytree(template, dest, symlinks=True, copy_function=Copier(mode),
+                    ignore=lambda src, names: [MARKER] if src == template else [])
+
+    old = os.fsencode(prefix)
+    new = os.fsencode(dest)
+    # Only scripts and configuration embed the path of the environment;
+    # files in site-packages refer to each other by relative paths.
+    candidates: List[str] = [os.path.join(dest, 'pyvenv.cfg')]
+    bin_dir = os.path.join(dest, 'bin')
+    for entry in os.scandir(bin_dir):
+        if entry.is_symlink():
+            target = os.readlink(entry.path)
+            if target == prefix or target.startswith(prefix + os.sep):
+                os.remove(entry.path)
+                os.symlink(dest + target[len(prefix):], entry.path)
+        elif entry.is_file():
+            candidates.append(entry.path)
+    for path in candidates:
+        if os.path.exists(path):
+            _rewrite(path, old, new)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Create virtual environments from a template')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    create_parser = subparsers.add_parser('create', help='Create a template')
+    create_parser.add_argument(
+        '--python', '-p', default='/usr/bin/python3',
+        help='Python interpreter for the environment [%(default)s]')
+    create_parser.add_argument(
+        '--requirement', '-r', action='append', default=[],
+        help='Install from the given requirements file')
+    create_parser.add_argument('template', help='Directory in which to create the template')
+
+    clone_parser = subparsers.add_parser('clone', help='Create an environment from a template')
+    clone_parser.add_argument(
+        '--mode', choices=['reflink', 'hardlink', 'copy'], default='reflink',
+        help='How to copy files from the template [%(default)s]')
+    clone_parser.add_argument('template', help='Template directory')
+    clone_parser.add_argument('dest', help='Directory in which to create the environment')
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == 'create':
+            create_template(args.template, args.python, args.requirement)
+        else:
+            clone(args.template, args.dest, args.mode)
+    except (OSError, RuntimeError, subprocess.CalledProcessError) as exc:
+        print(exc, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Produce a minimal copy of the CUDA toolkit for a runtime image.
+
+The full toolkit contains compilers, static libraries and headers that are
+not needed to run programs. This tool scans ELF files (shared libraries,
+Python extension modules and executables) under the given paths for the
+CUDA libraries they link against (``DT_NEEDED`` entries), adds libraries
+that are known to be loaded with ``dlopen`` rather than linked (such as
+NVRTC), follows the dependencies of those libraries within the toolkit,
+and copies just those files (with their symlinks) into a new tree with
+the same layout as the toolkit. Python packages that are known to use
+other parts of the toolkit at run time (such as libdevice for numba, or
+nvcc for pycuda) cause those to be kept too. Extra files can be kept with
+``--keep``, and the files needed to run nvcc with ``--nvcc``.
+
+A typical use is in the build stage of a child image::
+
+    cuda_trim.py --output /tmp/cuda ~/ve3 /usr/local/bin/my-program
+
+followed by copying /tmp/cuda to /usr/local/cuda-<version> in the runtime
+stage. It reports what was kept and why.
+"""
+
+import argparse
+import fnmatch
+import json
+import os
+import shutil
+import struct
+import sys
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+ELF_MAGIC = b'\x7fELF'
+SHT_DYNAMIC = 6
+DT_NULL = 0
+DT_NEEDED = 1
+
+#: Libraries loaded with dlopen (including via ctypes), indexed by the Python
+#: package that loads them
+DLOPEN_BY_PACKAGE = {
+    'skcuda': ['libcublas.so', 'libcufft.so', 'libcusolver.so', 'libcusparse.so',
+               'libcudart.so'],
+    'numba': ['libnvvm.so', 'libcudart.so'],
+}
+#: Files needed to compile with nvcc. The include directory is reached via
+#: a symlink at the top level, so it is matched under targets.
+NVCC_FILES = [
+    'bin/nvcc', 'bin/nvcc.profile', 'bin/ptxas', 'bin/cudafe++', 'bin/fatbinary',
+    'bin/nvlink', 'bin/bin2c', 'bin/crt/*', 'nvvm/bin/*', 'nvvm/lib64/*', 'nvvm/libdevice/*',
+    'targets/*/include/*',
+]
+#: Other files used at run time, indexed by the Python package that uses them
+FILES_BY_PACKAGE = {
+    'numba': ['nvvm/libdevice/*.bc'],
+    'pycuda': NVCC_FILES,     # SourceModule runs nvcc
+}
+#: Libraries that are dlopened by other libraries in the toolkit
+DLOPEN_BY_LIBRARY = {
+    'libnvrtc.so': ['libnvrtc-builtins.so'],
+}
+#: Small files that identify the toolkit version and are always kept
+ALWAYS_KEEP = ['version.txt', 'version.json']
+
+
+def read_needed(path: str) -> Optional[List[str]]:
+    """Get the ``DT_NEEDED`` entries from an ELF file.
+
+    Returns
+    -------
+    needed
+        The library names, or ``None`` if the file is not an ELF file
+    """
+    with open(path, 'rb') as f:
+        header = f.read(64)
+        if len(header) < 52 or header[:4] != ELF_MAGIC:
+            return None
+        is_64 = header[4] == 2
+        endian = '<' if header[5] == 1 else '>'
+        if is_64:
+            shoff, = struct.unpack_from(endian + 'Q', header, 0x28)
+            shentsize, shnum = struct.unpack_from(endian + 'HH', header, 0x3A)
+            section_fmt = endian + 'IIQQQQIIQQ'
+            dyn_fmt = endian + 'qQ'
+        else:
+            shoff, = struct.unpack_from(endian + 'I', header, 0x20)
+            shentsize, shnum = struct.unpack_from(endian + 'HH', header, 0x2E)
+            section_fmt = endian + 'IIIIIIIIII'
+            dyn_fmt = endian + 'iI'
+        if shoff == 0 or shnum == 0:
+            return []
+        f.seek(shoff)
+        raw = f.read(shentsize * shnum)
+        sections = [struct.unpack_from(section_fmt, raw, i * shentsize) for i in range(shnum)]
+        needed = []
+        for section in sections:
+            # Fields: name, type, flags, addr, offset, size, link, info, align, entsize
+            if section[1] != SHT_DYNAMIC:
+                continue
+            strtab = sections[section[6]]
+            f.seek(strtab[4])
+            strings = f.read(strtab[5])
+            f.seek(section[4])
+            dynamic = f.read(section[5])
+            entsize = struct.calcsize(dyn_fmt)
+            for i in range(len(dynamic) // entsize):
+                tag, value = struct.unpack_from(dyn_fmt, dynamic, i * entsize)
+                if tag == DT_NULL:
+                    break
+                if tag == DT_NEEDED:
+                    end = strings.index(b'\0', value)
+                    needed.append(strings[value:end].decode())
+        return needed
+
+
+def walk(paths: Iterable[str]) -> Iterable[str]:
+    """Yield all regular files under `paths` (which may also be files)."""
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            for name in files:
+                full = os.path.join(root, name)
+                if os.path.isfile(full) and not os.path.islink(full):
+                    yield full
+
+
+class Toolkit:
+    """Index of the libraries in a CUDA toolkit installation."""
+
+    def __init__(self, root: str) -> None:
+        self.root = os.path.realpath(root)
+        self.libraries: Dict[str, str] = {}      # Filename -> path (possibly a symlink)
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                if '.so' in name:
+                    self.libraries.setdefault(name, os.path.join(dirpath, name))
+
+    def chain(self, name: str) -> List[str]:
+        """Get the paths of the library file and all the symlinks leading to it."""
+        path = self.libraries[name]
+        paths = [path]
+        while os.path.islink(path):
+            path = os.path.join(os.path.dirname(path), os.readlink(path))
+            paths.append(os.path.normpath(path))
+        return paths
+
+
+class Trimmer:
+    """Determine which files of a toolkit to keep."""
+
+    def __init__(self, toolkit: Toolkit) -> None:
+        self.toolkit = toolkit
+        self.reasons: Dict[str, List[str]] = {}     # Library name -> reasons
+        self.patterns: Dict[str, str] = {}          # Pattern for other files -> reason
+        self._queue: List[str] = []
+
+    @staticmethod
+    def _read_needed(path: str) -> Optional[List[str]]:
+        """Wrap :func:`read_needed` to skip (with a warning) unreadable or malformed files."""
+        try:
+            return read_needed(path)
+        except (OSError, struct.error, IndexError, ValueError) as exc:
+            print(f'Warning: skipping {path}: {exc}', file=sys.stderr)
+            return None
+
+    def add(self, name: str, reason: str) -> None:
+        if name not in self.toolkit.libraries:
+            return      # Not part of the toolkit (e.g. a system library or the driver)
+        if name not in self.reasons:
+            self.reasons[name] = []
+            self._queue.append(name)
+        self.reasons[name].append(reason)
+
+    def scan(self, paths: Sequence[str]) -> None:
+        for path in walk(paths):
+            needed = self._read_needed(path)
+            if needed is None:
+                continue
+            for name in needed:
+                self.add(name, f'needed by {path}')
+        for path in paths:
+            for root, dirs, files in os.walk(path):
+                for package, libraries in DLOPEN_BY_PACKAGE.items():
+                    if package in dirs:
+                        for name in libraries:
+                            self.add(name, f'loaded with dlopen by {package}')
+                for package, patterns in FILES_BY_PACKAGE.items():
+                    if package in dirs:
+                        for pattern in patterns:
+                            self.patterns.setdefault(pattern, f'used by {package}')
+
+    def resolve(self) -> None:
+        """Add dependencies of the libraries found so far, recursively."""
+        while self._queue:
+            name = self._queue.pop()
+            real = self.toolkit.chain(name)[-1]
+            for dep in self._read_needed(real) or []:
+                self.add(dep, f'needed by {name}')
+            for prefix, libraries in DLOPEN_BY_LIBRARY.items():
+                if name.startswith(prefix):
+                    for lib in libraries:
+                        # dlopen names may be versioned; keep all matching files
+                        for candidate in self.toolkit.libraries:
+                            if candidate.startswith(lib):
+                                self.add(candidate, f'loaded with dlopen by {name}')
+
+    def files(self) -> Dict[str, str]:
+        """Get all files to keep (relative to the toolkit root) with the reason."""
+        root = self.toolkit.root
+        result: Dict[str, str] = {}
+        for name, reasons in self.reasons.items():
+            for path in self.toolkit.chain(name):
+                rel = os.path.relpath(os.path.realpath(os.path.dirname(path)), root)
+                rel = os.path.normpath(os.path.join(rel, os.path.basename(path)))
+                result.setdefault(rel, reasons[0])
+        for dirpath, dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                rel = os.path.relpath(os.path.join(dirpath, filename), root)
+                if rel in ALWAYS_KEEP:
+                    result.setdefault(rel, 'version information')
+                for pattern, reason in self.patterns.items():
+                    if fnmatch.fnmatchcase(rel, pattern):
+                        result.setdefault(rel, reason)
+        return result
+
+
+def copy_tree(root: str, files: Iterable[str], output: str) -> None:
+    """Copy `files` (relative to `root`) to `output`, preserving symlinks."""
+    for rel in sorted(files):
+        src = os.path.join(root, rel)
+        dst = os.path.join(output, rel)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if os.path.islink(src):
+            if os.path.lexists(dst):
+                os.remove(dst)
+            os.symlink(os.readlink(src), dst)
+        else:
+            shutil.copy2(src, dst)
+    # Recreate top-level symlinks (such as lib64) whose targets were kept
+    for entry in os.scandir(root):
+        if entry.is_symlink() and os.path.exists(os.path.join(output, os.readlink(entry.path))):
+            dst = os.path.join(output, entry.name)
+            if not os.path.lexists(dst):
+                os.symlink(os.readlink(entry.path), dst)
+
+
+def tree_size(root: str, files: Optional[Iterable[str]] = None) -> int:
+    if files is None:
+        files = (os.path.relpath(path, root) for path in walk([root]))
+    return sum(os.lstat(os.path.join(root, rel)).st_size for rel in files)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Copy the parts of the CUDA toolkit that are used by a set of files')
+    parser.add_argument(
+        '--cuda', default='/usr/local/cuda',
+        help='CUDA toolkit to trim [%(default)s]')
+    parser.add_argument('--output', '-o', required=True, help='Directory for the trimmed toolkit')
+    parser.add_argument(
+        '--dlopen', action='append', default=[], metavar='LIBRARY',
+        help='Keep a library that is loaded with dlopen (may be repeated)')
+    parser.add_argument(
+        '--keep', action='append', default=[], metavar='PATTERN',
+        help='Keep files matching a glob pattern relative to the toolkit (may be repeated)')
+    parser.add_argument(
+        '--nvcc', action='store_true', help='Keep the files needed to compile with nvcc')
+    parser.add_argument('--report', metavar='FILE', help='Write details as JSON to FILE')
+    parser.add_argument('--dry-run', '-n', action='store_true', help='Only report what to keep')
+    parser.add_argument('paths', nargs='+', help='Files or directories to scan')
+    args = parser.parse_args(argv)
+
+    toolkit = Toolkit(args.cuda)
+    trimmer = Trimmer(toolkit)
+    trimmer.scan(args.paths)
+    for name in args.dlopen:
+        for candidate in toolkit.libraries:
+            if candidate == name or candidate.startswith(name + '.'):
+                trimmer.add(candidate, 'requested with --dlopen')
+    for pattern in args.keep:
+        trimmer.patterns.setdefault(pattern, f'matches --keep {pattern}')
+    if args.nvcc:
+        for pattern in NVCC_FILES:
+            trimmer.patterns.setdefault(pattern, 'requested with --nvcc')
+    trimmer.resolve()
+    files = trimmer.files()
+
+    kept: List[Tuple[str, str]] = sorted(files.items())
+    for rel, reason in kept:
+        print(f'{rel}: {reason}')
+    full_size = tree_size(toolkit.root)
+    kept_size = tree_size(toolkit.root, files)
+    print(f'Keeping {len(kept)} files, {kept_size / 1e6:.1f} MB of {full_size / 1e6:.1f} MB')
+    if not args.dry_run:
+        copy_tree(toolkit.root, files, args.output)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({
+                'cuda': toolkit.root,
+                'full_size': full_size,
+                'kept_size': kept_size,
+                'files': [{'path': rel, 'reason': reason} for rel, reason in kept]
+            }, f, indent=2)
+            f.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+import json
+import os
+import pathlib
+import struct
+from typing import Sequence, Set
+
+import pytest
+
+import cuda_trim
+
+
+def make_elf(needed: Sequence[str]) -> bytes:
+    """Create a minimal 64-bit little-endian ELF file with a dynamic section."""
+    strings = b'\0'
+    offsets = []
+    for name in needed:
+        offsets.append(len(strings))
+        strings += name.encode() + b'\0'
+    dynamic = b''.join(struct.pack('<qQ', cuda_trim.DT_NEEDED, offset) for offset in offsets)
+    dynamic += struct.pack('<qQ', cuda_trim.DT_NULL, 0)
+    strtab_offset = 64
+    dynamic_offset = strtab_offset + len(strings)
+    shoff = dynamic_offset + len(dynamic)
+    header = bytearray(64)
+    header[:6] = b'\x7fELF\x02\x01'
+    struct.pack_into('<Q', header, 0x28, shoff)
+    struct.pack_into('<HH', header, 0x3A, 64, 3)
+    sections = [
+        struct.pack('<IIQQQQIIQQ', 0, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+        struct.pack('<IIQQQQIIQQ', 0, 3, 0, 0, strtab_offset, len(strings), 0, 0, 1, 0),
+        struct.pack('<IIQQQQIIQQ', 0, cuda_trim.SHT_DYNAMIC, 0, 0,
+                    dynamic_offset, len(dynamic), 1, 0, 8, 16)
+    ]
+    return bytes(header) + strings + dynamic + b''.join(sections)
+
+
+def _add_library(lib_dir: pathlib.Path, name: str, version: str,
+                 needed: Sequence[str] = ()) -> None:
+    real = f'{name}.{version}'
+    major = f'{name}.{version.split(".")[0]}'
+    (lib_dir / real).write_bytes(make_elf(needed))
+    (lib_dir / major).symlink_to(real)
+    (lib_dir / name).symlink_to(major)
+
+
+@pytest.fixture
+def cuda(tmp_path) -> pathlib.Path:
+    root = tmp_path / 'cuda'
+    lib_dir = root / 'targets' / 'x86_64-linux' / 'lib'
+    lib_dir.mkdir(parents=True)
+    (root / 'lib64').symlink_to('targets/x86_64-linux/lib')
+    include_dir = root / 'targets' / 'x86_64-linux' / 'include'
+    include_dir.mkdir()
+    (include_dir / 'cuda.h').write_text('')
+    (root / 'include').symlink_to('targets/x86_64-linux/include')
+    (root / 'bin').mkdir()
+    (root / 'bin' / 'nvcc').write_bytes(make_elf(['libc.so.6']))
+    (root / 'bin' / 'ptxas').write_bytes(make_elf(['libc.so.6']))
+    (root / 'bin' / 'nvcc.profile').write_text('')
+    (root / 'nvvm' / 'lib64').mkdir(parents=True)
+    _add_library(root / 'nvvm' / 'lib64', 'libnvvm.so', '4.0.0')
+    (root / 'nvvm' / 'libdevice').mkdir()
+    (root / 'nvvm' / 'libdevice' / 'libdevice.10.bc').write_bytes(b'BC')
+    (root / 'version.json').write_text('{}')
+    _add_library(lib_dir, 'libcudart.so', '11.4.108')
+    _add_library(lib_dir, 'libcublasLt.so', '11.6.1')
+    _add_library(lib_dir, 'libcublas.so', '11.6.1', ['libcublasLt.so.11', 'libc.so.6'])
+    _add_library(lib_dir, 'libcusolver.so', '11.2.0')
+    _add_library(lib_dir, 'libcusparse.so', '11.6.0')
+    _add_library(lib_dir, 'libnvrtc.so', '11.4.100')
+    _add_library(lib_dir, 'libnvrtc-builtins.so', '11.4.100')
+    _add_library(lib_dir, 'libcufft.so', '10.5.2')
+    (lib_dir / 'libcufft_static.a').write_bytes(b'!<arch>\n')
+    return root
+
+
+def test_read_needed(tmp_path) -> None:
+    path = tmp_path / 'lib.so'
+    path.write_bytes(make_elf(['libfoo.so.1', 'libc.so.6']))
+    assert cuda_trim.read_needed(str(path)) == ['libfoo.so.1', 'libc.so.6']
+    path.write_text('#!/bin/sh\n')
+    assert cuda_trim.read_needed(str(path)) is None
+
+
+@pytest.mark.skipif(not os.path.exists('/bin/ls'), reason='requires /bin/ls')
+def test_read_needed_real() -> None:
+    needed = cuda_trim.read_needed('/bin/ls')
+    assert needed is not None
+    assert any(name.startswith('libc.so') for name in needed)
+
+
+def test_malformed(tmp_path, cuda, capsys) -> None:
+    lib = cuda / 'targets' / 'x86_64-linux' / 'lib'
+    (lib / 'libcufft.so.10.5.2').write_bytes(make_elf([])[:80])     # Truncated
+    scan = tmp_path / 'scan'
+    scan.mkdir()
+    (scan / 'trunc.so').write_bytes(make_elf(['libcudart.so.11'])[:64])
+    (scan / 'prog').write_bytes(make_elf(['libcufft.so.10']))
+    bad_string = bytearray(make_elf(['libcublas.so.11']))
+    bad_string[65] = 0xff      # Not valid UTF-8
+    (scan / 'bad.so').write_bytes(bytes(bad_string))
+    output = tmp_path / 'output'
+    assert cuda_trim.main(['--cuda', str(cuda), '--output', str(output), str(scan)]) == 0
+    err = capsys.readouterr().err
+    assert f'Warning: skipping {scan / "trunc.so"}' in err
+    assert f'Warning: skipping {scan / "bad.so"}' in err
+    assert 'libcufft.so.10.5.2' in err
+    assert (output / 'targets' / 'x86_64-linux' / 'lib' / 'libcufft.so.10').exists()
+
+
+LIB = 'targets/x86_64-linux/lib'
+NVCC_KEPT = {
+    'include', 'targets/x86_64-linux/include/cuda.h',
+    'bin/nvcc', 'bin/ptxas', 'bin/nvcc.profile',
+    'nvvm/lib64/libnvvm.so', 'nvvm/lib64/libnvvm.so.4', 'nvvm/lib64/libnvvm.so.4.0.0',
+    'nvvm/libdevice/libdevice.10.bc'
+}
+
+
+def _kept(output: pathlib.Path) -> Set[str]:
+    return {str(path.relative_to(output)) for path in output.rglob('*')
+            if path.is_file() or path.is_symlink()}
+
+
+def _chain(name: str, version: str) -> Set[str]:
+    return {f'{LIB}/{name}', f'{LIB}/{name}.{version.split(".")[0]}', f'{LIB}/{name}.{version}'}
+
+
+def test_trim(tmp_path, cuda) -> None:
+    venv = tmp_path / 've3'
+    (venv / 'pycuda').mkdir(parents=True)
+    (venv / 'pycuda' / '_driver.so').write_bytes(make_elf(['libcuda.so.1', 'libcublas.so.11']))
+    (venv / 'other.so').write_bytes(make_elf(['libcudart.so.11.0']))   # Not in toolkit
+    output = tmp_path / 'output'
+    report = tmp_path / 'report.json'
+    assert cuda_trim.main(['--cuda', str(cuda), '--output', str(output),
+                           '--report', str(report), str(venv)]) == 0
+
+    # pycuda compiles SourceModule with nvcc
+    assert _kept(output) == NVCC_KEPT | {
+        'lib64',
+        'version.json',
+        f'{LIB}/libcublas.so.11', f'{LIB}/libcublas.so.11.6.1',
+        f'{LIB}/libcublasLt.so.11', f'{LIB}/libcublasLt.so.11.6.1'
+    }
+    assert os.readlink(output / LIB / 'libcublas.so.11') == 'libcublas.so.11.6.1'
+    assert (output / 'lib64' / 'libcublas.so.11').exists()
+    assert (output / 'include' / 'cuda.h').exists()
+
+    data = json.loads(report.read_text())
+    reasons = {item['path']: item['reason'] for item in data['files']}
+    assert reasons[f'{LIB}/libcublasLt.so.11'] == 'needed by libcublas.so.11'
+    assert reasons['bin/ptxas'] == 'used by pycuda'
+    assert data['kept_size'] < data['full_size']
+
+
+def test_skcuda(tmp_path, cuda) -> None:
+    venv = tmp_path / 've3'
+    (venv / 'skcuda').mkdir(parents=True)
+    (venv / 'skcuda' / 'cublas.py').write_text('import ctypes\n')
+    output = tmp_path / 'output'
+    assert cuda_trim.main(['--cuda', str(cuda), '--output', str(output), str(venv)]) == 0
+    assert _kept(output) == (
+        {'lib64', 'version.json', f'{LIB}/libcublasLt.so.11', f'{LIB}/libcublasLt.so.11.6.1'}
+        | _chain('libcublas.so', '11.6.1') | _chain('libcufft.so', '10.5.2')
+        | _chain('libcusolver.so', '11.2.0') | _chain('libcusparse.so', '11.6.0')
+        | _chain('libcudart.so', '11.4.108'))
+
+
+def test_numba(tmp_path, cuda) -> None:
+    venv = tmp_path / 've3'
+    (venv / 'numba' / 'cuda').mkdir(parents=True)
+    output = tmp_path / 'output'
+    assert cuda_trim.main(['--cuda', str(cuda), '--output', str(output), str(venv)]) == 0
+    assert _kept(output) == (
+        {'lib64', 'version.json', 'nvvm/libdevice/libdevice.10.bc',
+         'nvvm/lib64/libnvvm.so', 'nvvm/lib64/libnvvm.so.4', 'nvvm/lib64/libnvvm.so.4.0.0'}
+        | _chain('libcudart.so', '11.4.108'))
+
+
+def test_nvcc_and_keep(tmp_path, cuda) -> None:
+    output = tmp_path / 'output'
+    empty = tmp_path / 'empty'
+    empty.mkdir()
+    assert cuda_trim.main(['--cuda', str(cuda), '--output', str(output), '--nvcc',
+                           '--dlopen', 'libnvrtc.so', '--keep', f'{LIB}/*.a', str(empty)]) == 0
+    assert _kept(output) == NVCC_KEPT | {
+        'version.json', 'lib64', f'{LIB}/libcufft_static.a'
+    } | _chain('libnvrtc.so', '11.4.100') | _chain('libnvrtc-builtins.so', '11.4.100')
+
+
+def test_dry_run(tmp_path, cuda) -> None:
+    output = tmp_path / 'output'
+    binary = tmp_path / 'prog'
+    binary.write_bytes(make_elf(['libcufft.so.10']))
+    assert cuda_trim.main(['--cuda', str(cuda), '--output', str(output), '--dry-run',
+                           '--dlopen', 'libcudart.so', str(binary)]) == 0
+    assert not output.exists()
@@ -0,0 +1,465 @@
+/* Copyright (c) 2021, National Research Foundation (SARAO)
+ *
+ * Licensed under the BSD 3-Clause License (the "License"); you may not use
+ * this file except in compliance with the License. You may obtain a copy
+ * of the License at
+ *
+ *   https://opensource.org/licenses/BSD-3-Clause
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+/* Applies a CPU and memory placement to the process, then executes another
+ * program. The placement can be given by command-line options or in a spec
+ * file (-f) containing lines of the form "key = value", where the keys are
+ * the long option names; options given on the command line take precedence
+ * regardless of order. For example:
+ *
+ *   cpus = 2-5,8
+ *   mem-nodes = 0
+ *   policy = fifo
+ *   priority = 10
+ *   lock-memory = all
+ *
+ * - cpus: CPU affinity
+ * - mem-nodes, mem-policy: NUMA memory policy (bind, preferred or
+ *   interleave) for the given nodes
+ * - policy, priority: scheduling policy (other, fifo or rr) and real-time
+ *   priority, which may not exceed PLACEMENT_MAX_PRIORITY
+ * - lock-memory: lock all memory (all) or lock pages as they are faulted in
+ *   (onfault). Memory locks are not preserved across exec, so this is done
+ *   by preloading a library (PLACEMENT_MLOCK_LIBRARY) into the program.
+ *   "all" also prefaults memory as it is mapped.
+ *
+ * After applying the placement it is read back and checked, and reported
+ * if -v is given. Memory locking only happens after exec, so it cannot be
+ * checked here; instead, with -v the preloaded library reports when it has
+ * locked memory. If that report is missing, the library was not loaded
+ * (for example because the program is statically linked, or runs in
+ * secure-execution mode due to file capabilities) and memory is not locked.
+ *
+ * The privileges needed (CAP_SYS_NICE for real-time scheduling,
+ * CAP_IPC_LOCK for memory locking) can be obtained with capambel.
+ */
+
+#ifndef _GNU_SOURCE
+# define _GNU_SOURCE
+#endif
+#include <stdio.h>
+#include <stdbool.h>
+#include <stddef.h>
+#include <stdlib.h>
+#include <string.h>
+#include <ctype.h>
+#include <errno.h>
+#include <limits.h>
+#include <unistd.h>
+#include <getopt.h>
+#include <sched.h>
+#include <sys/syscall.h>
+
+#ifndef PLACEMENT_MAX_PRIORITY
+# define PLACEMENT_MAX_PRIORITY 50
+#endif
+#ifndef PLACEMENT_MLOCK_LIBRARY
+# define PLACEMENT_MLOCK_LIBRARY "/usr/local/lib/libplacement_mlock.so"
+#endif
+
+/* From <numaif.h>, which is not installed by default */
+#define MPOL_DEFAULT 0
+#define MPOL_PREFERRED 1
+#define MPOL_BIND 2
+#define MPOL_INTERLEAVE 3
+
+#define MAX_NODES 1024
+#define NODEMASK_WORDS (MAX_NODES / (8 * sizeof(unsigned long)))
+
+struct placement
+{
+    bool have_cpus;
+    cpu_set_t cpus;
+    bool have_nodes;
+    unsigned long nodes[NODEMASK_WORDS];
+    int mem_policy;
+    int policy;                 /* -1 if not specified */
+    int priority;               /* -1 if not specified */
+    const char *lock;           /* NULL, "all" or "onfault" */
+    bool verbose;
+};
+
+static const struct option options[] =
+{
+    {"verbose", no_argument, 0, 'v'},
+    {"file", required_argument, 0, 'f'},
+    {"cpus", required_argument, 0, 'c'},
+    {"mem-nodes", required_argument, 0, 'm'},
+    {"mem-policy", required_argument, 0, 'M'},
+    {"policy", required_argument, 0, 's'},
+    {"priority", required_argument, 0, 'p'},
+    {"lock-memory", required_argument, 0, 'l'},
+    {0, 0, 0, 0}
+};
+
+static void usage(void)
+{
+    fputs("Usage: placement [-v] [-f spec] [--cpus list] [--mem-nodes list]\n"
+          "                 [--mem-policy bind|preferred|interleave]\n"
+          "                 [--policy other|fifo|rr] [--priority n]\n"
+          "                 [--lock-memory all|onfault] -- <program> [<args>...]\n", stderr);
+    exit(2);
+}
+
+static void fail(const char *msg, const char *arg)
+{
+    fprintf(stderr, "placement: %s: %s\n", msg, arg);
+    exit(2);
+}
+
+static void check(int result, const char *name)
+{
+    if (result != 0)
+    {
+        perror(name);
+        exit(1);
+    }
+}
+
+/* Parse a list like "0-3,8,10-11", calling set(i) for each element. */
+static void parse_list(const char *list, int max, void (*set)(void *, int), void *data)
+{
+    const char *p = list;
+    while (*p)
+    {
+        char *end;
+        long first, last;
+
+        errno = 0;
+        first = strtol(p, &end, 10);
+        if (end == p || errno != 0)
+            fail("invalid list", list);
+        last = first;
+        if (*end == '-')
+        {
+            p = end + 1;
+            last = strtol(p, &end, 10);
+            if (end == p || errno != 0)
+                fail("invalid list", list);
+        }
+        if (first < 0 || last < first || last >= max)
+            fail("invalid range in list", list);
+        for (long i = first; i <= last; i++)
+            set(data, i);
+        if (*end == ',')
+            end++;
+        else if (*end != '\0')
+            fail("invalid list", list);
+        p = end;
+    }
+}
+
+static void set_cpu(void *data, int cpu)
+{
+    CPU_SET(cpu, (cpu_set_t *) data);
+}
+
+static void set_node(void *data, int node)
+{
+    unsigned long *nodes = data;
+    nodes[node / (8 * sizeof(unsigned long))] |= 1UL << (node % (8 * sizeof(unsigned long)));
+}
+
+static int lookup(const char *value, const char * const names[], const int values[], int n)
+{
+    for (int i = 0; i < n; i++)
+        if (strcmp(value, names[i]) == 0)
+            return values[i];
+    fail("unknown value", value);
+    return -1;
+}
+
+static void apply_option(struct placement *pl, int opt, const char *value)
+{
+    static const char * const mem_policy_names[] = {"bind", "preferred", "interleave"};
+    static const int mem_policy_values[] = {MPOL_BIND, MPOL_PREFERRED, MPOL_INTERLEAVE};
+    static const char * const policy_names[] = {"other", "fifo", "rr"};
+    static const int policy_values[] = {SCHED_OTHER, SCHED_FIFO, SCHED_RR};
+    char *end;
+
+    switch (opt)
+    {
+    case 'c':
+        CPU_ZERO(&pl->cpus);
+        parse_list(value, CPU_SETSIZE, set_cpu, &pl->cpus);
+        pl->have_cpus = true;
+        break;
+    case 'm':
+        memset(pl->nodes, 0, sizeof(pl->nodes));
+        parse_list(value, MAX_NODES, set_node, pl->nodes);
+        pl->have_nodes = true;
+        break;
+    case 'M':
+        pl->mem_policy = lookup(value, mem_policy_names, mem_policy_values, 3);
+        break;
+    case 's':
+        pl->policy = lookup(value, policy_names, policy_values, 3);
+        break;
+    case 'p':
+        errno = 0;
+        pl->priority = strtol(value, &end, 10);
+        if (*value == '\0' || *end != '\0' || errno != 0 || pl->priority < 0)
+            fail("invalid priority", value);
+        if (pl->priority > PLACEMENT_MAX_PRIORITY)
+            fail("priority exceeds the maximum allowed", value);
+        break;
+    case 'l':
+        if (strcmp(value, "all") == 0 || strcmp(value, "onfault") == 0)
+            pl->lock = strdup(value);
+        else if (strcmp(value, "none") == 0)
+            pl->lock = NULL;
+        else
+            fail("unknown value", value);
+        break;
+    case 'v':
+        pl->verbose = strcmp(value, "no") != 0 && strcmp(value, "false") != 0;
+        break;
+    }
+}
+
+static char *strip(char *s)
+{
+    char *end;
+    while (isspace((unsigned char) *s))
+        s++;
+    end = s + strlen(s);
+    while (end > s && isspace((unsigned char) end[-1]))
+        end--;
+    *end = '\0';
+    return s;
+}
+
+static void read_spec(struct placement *pl, const char *filename)
+{
+    FILE *f = fopen(filename, "r");
+    char line[4096];
+
+    if (!f)
+    {
+        perror(filename);
+        exit(1);
+    }
+    while (fgets(line, sizeof(line), f))
+    {
+        char *key, *value, *eq;
+        const struct option *o;
+
+        line[strcspn(line, "#\n")] = '\0';
+        key = strip(line);
+        if (*key == '\0')
+            continue;
+        eq = strchr(key, '=');
+        if (!eq)
+            fail("expected key = value in spec", key);
+        *eq = '\0';
+        key = strip(key);
+        value = strip(eq + 1);
+        for (o = options; o->name; o++)
+            if (strcmp(o->name, key) == 0 && o->val != 'f')
+                break;
+        if (!o->name)
+            fail("unknown key in spec", key);
+        apply_option(pl, o->val, value);
+    }
+    fclose(f);
+}
+
+static void format_list(char *out, size_t size, bool (*isset)(const void *, int), const void *data,
+                        int max)
+{
+    size_t pos = 0;
+    out[0] = '\0';
+    for (int i = 0; i < max; i++)
+    {
+        if (!isset(data, i) || (i > 0 && isset(data, i - 1)))
+            continue;
+        int j = i;
+        while (j + 1 < max && isset(data, j + 1))
+            j++;
+        if (pos < size)
+            pos += snprintf(out + pos, size - pos, pos ? ",%d" : "%d", i);
+        if (j > i && pos < size)
+            pos += snprintf(out + pos, size - pos, "-%d", j);
+    }
+}
+
+static bool cpu_isset(const void *data, int cpu)
+{
+    return CPU_ISSET(cpu, (const cpu_set_t *) data);
+}
+
+static bool node_isset(const void *data, int node)
+{
+    const unsigned long *nodes = data;
+    return (nodes[node / (8 * sizeof(unsigned long))] >> (node % (8 * sizeof(unsigned long)))) & 1;
+}
+
+static void apply(const struct placement *pl)
+{
+    /* Memory policy is applied first, so that later allocations follow it */
+    if (pl->have_nodes)
+        check(syscall(SYS_set_mempolicy, pl->mem_policy, pl->nodes, MAX_NODES + 1),
+              "set_mempolicy");
+    if (pl->have_cpus)
+        check(sched_setaffinity(0, sizeof(pl->cpus), &pl->cpus), "sched_setaffinity");
+    if (pl->policy != -1 || pl->priority != -1)
+    {
+        struct sched_param param = {};
+        int policy = pl->policy;
+
+        if (policy == -1)
+            policy = SCHED_RR;
+        if (policy != SCHED_OTHER)
+            param.sched_priority = pl->priority == -1 ? 1 : pl->priority;
+        check(sched_setscheduler(0, policy, &param), "sched_setscheduler");
+    }
+    if (pl->lock)
+    {
+        const char *old = getenv("LD_PRELOAD");
+        char *value;
+        if (old && *old)
+        {
+            if (asprintf(&value, "%s:%s", PLACEMENT_MLOCK_LIBRARY, old) < 0)
+                value = NULL;
+        }
+        else
+            value = strdup(PLACEMENT_MLOCK_LIBRARY);
+        if (!value)
+        {
+            perror("placement");
+            exit(1);
+        }
+        check(setenv("LD_PRELOAD", value, 1), "setenv");
+        check(setenv("PLACEMENT_LOCK_MEMORY", pl->lock, 1), "setenv");
+        if (pl->verbose)
+            check(setenv("PLACEMENT_VERBOSE", "1", 1), "setenv");
+        free(value);
+        if (access(PLACEMENT_MLOCK_LIBRARY, R_OK) != 0)
+        {
+            perror(PLACEMENT_MLOCK_LIBRARY);
+            exit(1);
+        }
+    }
+}
+
+/* Read back the placement, check that it matches the request and report it. */
+static void verify(const struct placement *pl)
+{
+    static const char * const policy_names[] = {
+        [SCHED_OTHER] = "other", [SCHED_FIFO] = "fifo", [SCHED_RR] = "rr"
+    };
+    static const char * const mem_policy_names[] = {
+        [MPOL_DEFAULT] = "default", [MPOL_PREFERRED] = "preferred",
+        [MPOL_BIND] = "bind", [MPOL_INTERLEAVE] = "interleave"
+    };
+    cpu_set_t cpus;
+    unsigned long nodes[NODEMASK_WORDS] = {};
+    int mem_policy;
+    int policy;
+    struct sched_param param;
+    char buf[4096];
+    bool ok = true;
+
+    check(sched_getaffinity(0, sizeof(cpus), &cpus), "sched_getaffinity");
+    check(syscall(SYS_get_mempolicy, &mem_policy, nodes, MAX_NODES, NULL, 0), "get_mempolicy");
+    policy = sched_getscheduler(0);
+    if (policy < 0)
+    {
+        perror("sched_getscheduler");
+        exit(1);
+    }
+    check(sched_getparam(0, &param), "sched_getparam");
+
+    if (pl->have_cpus && !CPU_EQUAL(&cpus, &pl->cpus))
+        ok = false;
+    if (pl->have_nodes && (mem_policy != pl->mem_policy || memcmp(nodes, pl->nodes, sizeof(nodes))))
+        ok = false;
+    if (pl->policy != -1 && policy != pl->policy)
+        ok = false;
+    if (pl->priority != -1 && policy != SCHED_OTHER && param.sched_priority != pl->priority)
+        ok = false;
+
+    if (pl->verbose || !ok)
+    {
+        format_list(buf, sizeof(buf), cpu_isset, &cpus, CPU_SETSIZE);
+        fprintf(stderr, "placement: cpus %s\n", buf);
+        format_list(buf, sizeof(buf), node_isset, nodes, MAX_NODES);
+        fprintf(stderr, "placement: memory policy %s%s%s\n",
+                mem_policy >= 0 && mem_policy <= MPOL_INTERLEAVE
+                    ? mem_policy_names[mem_policy] : "unknown",
+                buf[0] ? " on nodes " : "", buf);
+        fprintf(stderr, "placement: scheduling policy %s priority %d\n",
+                policy >= 0 && policy <= SCHED_RR ? policy_names[policy] : "unknown",
+                param.sched_priority);
+        if (pl->lock)
+            fprintf(stderr, "placement: memory locking %s requested (not verifiable before exec)\n",
+                    pl->lock);
+        else
+            fputs("placement: memory locking none\n", stderr);
+    }
+    if (!ok)
+    {
+        fputs("placement: placement does not match the request\n", stderr);
+        exit(1);
+    }
+}
+
+int main(int argc, char * const argv[])
+{
+    struct placement pl = {
+        .mem_policy = MPOL_BIND, .policy = -1, .priority = -1
+    };
+    int opt;
+
+    /* First pass: only handle spec files, so that other options override them */
+    do
+    {
+        switch (opt = getopt_long(argc, argv, "+vf:", options, NULL))
+        {
+        case -1:
+            break;
+        case 'f':
+            read_spec(&pl, optarg);
+            break;
+        case '?':
+            usage();
+        }
+    } while (opt != -1);
+
+    optind = 1;
+    do
+    {
+        switch (opt = getopt_long(argc, argv, "+vf:", options, NULL))
+        {
+        case -1:
+        case 'f':
+            break;
+        case 'v':
+            pl.verbose = true;
+            break;
+        default:
+            apply_option(&pl, opt, optarg);
+        }
+    } while (opt != -1);
+    if (optind >= argc)
+        usage();
+
+    apply(&pl);
+    verify(&pl);
+
+    execvp(argv[optind], argv + optind);
+    perror("execvp");
+    return 1;
+}
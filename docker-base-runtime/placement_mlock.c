@@ -0,0 +1,106 @@
+/* Copyright (c) 2021, National Research Foundation (SARAO)
+ *
+ * Licensed under the BSD 3-Clause License (the "License"); you may not use
+ * this file except in compliance with the License. You may obtain a copy
+ * of the License at
+ *
+ *   https://opensource.org/licenses/BSD-3-Clause
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+/* Library preloaded by placement to lock the memory of a program, since
+ * memory locks do not survive exec. The PLACEMENT_LOCK_MEMORY environment
+ * variable selects between locking (and hence prefaulting) all current and
+ * future mappings ("all") or locking pages only as they are faulted in
+ * ("onfault"). If locking fails, the program is not started. If
+ * PLACEMENT_VERBOSE is set, success is reported, since placement itself
+ * cannot check it. The library
+ * removes itself from LD_PRELOAD so that it is not inherited by processes
+ * started by the program.
+ */
+
+#ifndef _GNU_SOURCE
+# define _GNU_SOURCE
+#endif
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <sys/mman.h>
+
+#ifndef MCL_ONFAULT
+# define MCL_ONFAULT 4
+#endif
+
+#define PLACEMENT_MLOCK_NAME "libplacement_mlock.so"
+
+/* Remove this library from LD_PRELOAD (whose entries are separated by
+ * colons or spaces).
+ */
+static void remove_preload(void)
+{
+    const char *old = getenv("LD_PRELOAD");
+    char *copy, *value, *token, *saveptr;
+    size_t len = 0;
+
+    if (!old)
+        return;
+    copy = strdup(old);
+    value = malloc(strlen(old) + 1);
+    if (!copy || !value)
+    {
+        perror("placement");
+        _exit(1);
+    }
+    for (token = strtok_r(copy, ": ", &saveptr); token; token = strtok_r(NULL, ": ", &saveptr))
+    {
+        const char *base = strrchr(token, '/');
+        base = base ? base + 1 : token;
+        if (strcmp(base, PLACEMENT_MLOCK_NAME) == 0)
+            continue;
+        if (len > 0)
+            value[len++] = ':';
+        strcpy(value + len, token);
+        len += strlen(token);
+    }
+    value[len] = '\0';
+    if (len > 0)
+        setenv("LD_PRELOAD", value, 1);
+    else
+        unsetenv("LD_PRELOAD");
+    free(copy);
+    free(value);
+}
+
+__attribute__((constructor))
+static void placement_mlock(void)
+{
+    const char *mode = getenv("PLACEMENT_LOCK_MEMORY");
+    int flags = MCL_CURRENT | MCL_FUTURE;
+
+    remove_preload();
+    if (!mode || !*mode)
+        return;
+    if (strcmp(mode, "onfault") == 0)
+        flags |= MCL_ONFAULT;
+    else if (strcmp(mode, "all") != 0)
+    {
+        fprintf(stderr, "placement: unknown PLACEMENT_LOCK_MEMORY value %s\n", mode);
+        _exit(1);
+    }
+    if (mlockall(flags) != 0)
+    {
+        perror("placement: mlockall");
+        _exit(1);
+    }
+    if (getenv("PLACEMENT_VERBOSE"))
+        fprintf(stderr, "placement: memory locked (%s)\n", mode);
+    /* Child processes started by the program do not need locking */
+    unsetenv("PLACEMENT_LOCK_MEMORY");
+    unsetenv("PLACEMENT_VERBOSE");
+}
@@ -0,0 +1,118 @@
+import os
+import pathlib
+import shutil
+import subprocess
+from typing import Dict, List
+
+import pytest
+
+
+SRC = pathlib.Path(__file__).parent
+
+pytestmark = pytest.mark.skipif(shutil.which('gcc') is None, reason='requires gcc')
+
+
+@pytest.fixture(scope='module')
+def placement(tmp_path_factory) -> str:
+    """Compile placement and its preload library into a temporary directory."""
+    build = tmp_path_factory.mktemp('placement')
+    library = build / 'libplacement_mlock.so'
+    subprocess.run(['gcc', '-shared', '-fPIC', '-o', str(library),
+                    str(SRC / 'placement_mlock.c'), '-Wall', '-Wextra', '-O2'], check=True)
+    binary = build / 'placement'
+    subprocess.run(['gcc', '-o', str(binary), str(SRC / 'placement.c'), '-Wall', '-Wextra', '-O2',
+                    f'-DPLACEMENT_MLOCK_LIBRARY="{library}"'], check=True)
+    return str(binary)
+
+
+def _run(placement: str, args: List[str]) -> subprocess.CompletedProcess:
+    return subprocess.run([placement] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, timeout=30)
+
+
+def _status(output: str) -> Dict[str, str]:
+    fields = {}
+    for line in output.splitlines():
+        key, _, value = line.partition(':')
+        fields[key] = value.strip()
+    return fields
+
+
+def test_cpus(placement) -> None:
+    cpu = min(os.sched_getaffinity(0))
+    with open('/proc/self/status') as f:
+        mems = _status(f.read())['Mems_allowed_list']
+    # -E also checks that options after the program name are left alone
+    result = _run(placement, ['--cpus', str(cpu), 'grep', '-E', '_allowed_list:',
+                              '/proc/self/status'])
+    assert result.returncode == 0, result.stderr
+    status = _status(result.stdout)
+    assert status['Cpus_allowed_list'] == str(cpu)
+    assert status['Mems_allowed_list'] == mems
+
+
+def test_mem_nodes(placement) -> None:
+    if not os.path.exists('/proc/self/numa_maps'):
+        pytest.skip('requires NUMA support')
+    result = _run(placement, ['--mem-nodes', '0', 'head', '-n', '1', '/proc/self/numa_maps'])
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split()[1] == 'bind:0'
+
+
+def test_spec_file(placement, tmp_path) -> None:
+    cpu = min(os.sched_getaffinity(0))
+    spec = tmp_path / 'spec'
+    spec.write_text(f'# Comment\ncpus = {cpu}\npolicy = other\n')
+    result = _run(placement, ['-v', '-f', str(spec), 'cat', '/proc/self/status'])
+    assert result.returncode == 0, result.stderr
+    assert _status(result.stdout)['Cpus_allowed_list'] == str(cpu)
+    assert f'placement: cpus {cpu}\n' in result.stderr
+
+
+def test_priority_limit(placement) -> None:
+    result = _run(placement, ['--policy', 'fifo', '--priority', '51', 'true'])
+    assert result.returncode == 2
+    assert 'priority exceeds the maximum allowed' in result.stderr
+
+
+def test_lock_memory(placement) -> None:
+    result = _run(placement, ['--lock-memory', 'all', 'cat', '/proc/self/status'])
+    if result.returncode != 0 and 'mlockall' in result.stderr:
+        pytest.skip('not permitted to lock memory')
+    assert result.returncode == 0, result.stderr
+    assert _status(result.stdout)['VmLck'] != '0 kB'
+
+
+def test_lock_memory_not_inherited(placement) -> None:
+    result = _run(placement, ['--lock-memory', 'all', 'sh', '-c',
+                              'env; grep VmLck /proc/self/status'])
+    if result.returncode != 0 and 'mlockall' in result.stderr:
+        pytest.skip('not permitted to lock memory')
+    assert result.returncode == 0, result.stderr
+    assert 'libplacement_mlock' not in result.stdout
+    assert 'PLACEMENT_LOCK_MEMORY' not in result.stdout
+    assert _status(result.stdout)['VmLck'] == '0 kB'
+
+
+def test_lock_memory_verbose(placement) -> None:
+    result = _run(placement, ['-v', '--lock-memory', 'onfault', 'sh', '-c',
+                              'env | grep PLACEMENT_ || true'])
+    if result.returncode != 0 and 'mlockall' in result.stderr:
+        pytest.skip('not permitted to lock memory')
+    assert result.returncode == 0, result.stderr
+    assert 'memory locking onfault requested' in result.stderr
+    assert 'placement: memory locked (onfault)\n' in result.stderr
+    assert result.stdout == ''
+
+
+def test_lock_memory_static(placement, tmp_path) -> None:
+    """The library cannot be preloaded into a static program, so there is no confirmation."""
+    source = tmp_path / 'static.c'
+    source.write_text('int main(void) { return 0; }\n')
+    binary = tmp_path / 'static'
+    if subprocess.run(['gcc', '-static', '-o', str(binary), str(source)]).returncode != 0:
+        pytest.skip('cannot link statically')
+    result = _run(placement, ['-v', '--lock-memory', 'all', str(binary)])
+    assert result.returncode == 0, result.stderr
+    assert 'memory locking all requested' in result.stderr
+    assert 'memory locked' not in result.stderr
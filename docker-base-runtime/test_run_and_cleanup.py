@@ -0,0 +1,277 @@
+import argparse
+import importlib.machinery
+import importlib.util
+import json
+import os
+import pathlib
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+
+SCRIPT = pathlib.Path(__file__).parent / 'run-and-cleanup'
+
+
+def _load_script():
+    loader = importlib.machinery.SourceFileLoader('run_and_cleanup', str(SCRIPT))
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+rac = _load_script()
+
+
+def _make_tree(root: pathlib.Path) -> None:
+    for i in range(3):
+        sub = root / f'dir{i}' / 'nested'
+        sub.mkdir(parents=True)
+        for j in range(5):
+            (sub / f'file{j}').write_text('x')
+    (root / 'link').symlink_to('/nonexistent')
+
+
+def _wait_until(condition, timeout: float = 10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+def test_ioprio() -> None:
+    assert rac.ioprio('idle') == 3 << 13
+    assert rac.ioprio('be:4') == (2 << 13) | 4
+    for bad in ['fast', 'be:x', 'rt:8']:
+        with pytest.raises(argparse.ArgumentTypeError):
+            rac.ioprio(bad)
+
+
+def test_positive_int() -> None:
+    assert rac.positive_int('3') == 3
+    for bad in ['0', '-1', 'x']:
+        with pytest.raises(argparse.ArgumentTypeError):
+            rac.positive_int(bad)
+
+
+def test_main_cleanup_workers_zero(tmp_path) -> None:
+    result = subprocess.run(
+        [sys.executable, str(SCRIPT), '--cleanup-workers', '0', '-c', str(tmp_path / 'dir'),
+         '--', 'true'],
+        stderr=subprocess.PIPE, universal_newlines=True, timeout=30)
+    assert result.returncode == 2
+    assert '--cleanup-workers' in result.stderr
+
+
+def test_remover(tmp_path) -> None:
+    root = tmp_path / 'scratch'
+    _make_tree(root)
+    remover = rac.Remover(4)
+    assert remover.remove(str(root)) == (16, 7)
+    assert not root.exists()
+    (tmp_path / 'file').write_text('x')
+    assert remover.remove(str(tmp_path / 'file')) == (1, 0)
+    assert remover.remove(str(tmp_path / 'missing')) == (0, 0)
+
+
+def test_reap(tmp_path) -> None:
+    trash = tmp_path / 'trash'
+    _make_tree(trash / 'old1')
+    _make_tree(trash / 'old2')
+    rac.reap(rac.Remover(2), str(trash), False)
+    assert list(trash.iterdir()) == []
+
+
+def test_cleanup_trash(tmp_path) -> None:
+    path = tmp_path / 'scratch'
+    trash = tmp_path / 'trash'
+    _make_tree(path)
+    trash.mkdir()
+    rac.cleanup(rac.Scratch(str(path)), rac.Remover(2), str(trash), False, 2, None)
+    assert not path.exists()
+    assert _wait_until(lambda: list(trash.iterdir()) == [])
+
+
+def test_cleanup_trash_fallback(tmp_path, capsys) -> None:
+    path = tmp_path / 'scratch'
+    _make_tree(path)
+    # The trash does not exist, so the path is removed where it is
+    rac.cleanup(rac.Scratch(str(path)), rac.Remover(2), str(tmp_path / 'missing'), False, 2, None)
+    assert 'could not move' in capsys.readouterr().err
+    assert _wait_until(lambda: not path.exists())
+
+
+def test_main_trash(tmp_path) -> None:
+    path = tmp_path / 'scratch'
+    trash = tmp_path / 'trash'
+    result = subprocess.run(
+        [sys.executable, str(SCRIPT), '--create', '--trash', str(trash), str(path), '--',
+         'sh', '-c', 'mkdir -p "$0/a/b" && touch "$0/a/b/c" && exit 3', str(path)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30)
+    assert result.returncode == 3
+    assert not path.exists()
+    assert _wait_until(lambda: list(trash.iterdir()) == [])
+    assert os.path.isdir(trash)
+
+
+def test_read_cgroup(tmp_path) -> None:
+    (tmp_path / 'memory.current').write_text('1000\n')
+    (tmp_path / 'cpu.stat').write_text('usage_usec 30\nuser_usec 20\nsystem_usec 10\n'
+                                       'nr_periods 0\n')
+    (tmp_path / 'io.stat').write_text('8:0 rbytes=100 wbytes=200 rios=1 wios=2 dbytes=0\n'
+                                      '8:16 rbytes=1 wbytes=2 rios=3 wios=4 dbytes=0\n')
+    assert rac.read_cgroup(str(tmp_path)) == {
+        'memory_current': 1000,
+        'cpu_usage_usec': 30, 'cpu_user_usec': 20, 'cpu_system_usec': 10,
+        'io_rbytes': 101, 'io_wbytes': 202, 'io_rios': 4, 'io_wios': 6
+    }
+    assert rac.read_cgroup(str(tmp_path / 'missing')) == {}
+
+
+def test_metrics_sink_file(tmp_path) -> None:
+    path = tmp_path / 'metrics.json'
+    path.write_text('{"old": 1}\n')
+    sink = rac.MetricsSink(str(path))
+    sink.write({'b': 2, 'a': 1})
+    sink.close()
+    assert path.read_text() == '{"old": 1}\n{"a": 1, "b": 2}\n'
+
+
+def test_metrics_sink_unix(tmp_path) -> None:
+    path = str(tmp_path / 'sock')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(path)
+        server.listen(1)
+        sink = rac.MetricsSink('unix:' + path)
+        conn, _ = server.accept()
+        sink.write({'x': 1})
+        sink.close()
+        with conn:
+            assert conn.makefile().read() == '{"x": 1}\n'
+
+
+def test_wait() -> None:
+    sub = subprocess.Popen(['sh', '-c', 'exit 5'])
+    retcode, rusage = rac.wait(sub)
+    assert retcode == sub.returncode == 5
+    assert rusage.ru_utime >= 0
+    sub = subprocess.Popen(['sh', '-c', 'kill -TERM $$'])
+    assert rac.wait(sub)[0] == -signal.SIGTERM
+
+
+def test_monitor_summary_unsampled(tmp_path) -> None:
+    sink = rac.MetricsSink(str(tmp_path / 'metrics.json'))
+    monitor = rac.Monitor(rac.Scratch(str(tmp_path)), sink, 1000.0)
+    sub = subprocess.Popen(['true'])
+    record = monitor.summary(['true'], *rac.wait(sub))
+    assert record['exit_code'] == 0
+    assert record['scratch']['peak_bytes'] is None
+    assert record['scratch']['last_sample_bytes'] is None
+
+
+def test_main_metrics(tmp_path) -> None:
+    path = tmp_path / 'scratch'
+    metrics = tmp_path / 'metrics.json'
+    result = subprocess.run(
+        [sys.executable, str(SCRIPT), '--create', '--metrics', str(metrics),
+         '--metrics-interval', '0.05', str(path), '--',
+         'sh', '-c', 'head -c 100000 /dev/urandom > "$0/data" && sleep 0.5', str(path)],
+        timeout=30)
+    assert result.returncode == 0
+    records = [json.loads(line) for line in metrics.read_text().splitlines()]
+    assert records[0]['type'] == 'sample'
+    summary = records[-1]
+    assert summary['type'] == 'summary'
+    assert summary['scratch']['peak_bytes'] >= 100000
+
+
+def test_main_metrics_interval_without_metrics(tmp_path) -> None:
+    result = subprocess.run(
+        [sys.executable, str(SCRIPT), '--metrics-interval', '1', str(tmp_path), '--', 'true'],
+        stderr=subprocess.PIPE, universal_newlines=True, timeout=30)
+    assert result.returncode == 2
+    assert '--metrics-interval requires --metrics' in result.stderr
+
+
+def test_size() -> None:
+    assert rac.size('123') == 123
+    assert rac.size('4k') == 4096
+    assert rac.size('2G') == 2 * 2**30
+    for bad in ['', 'k', '1x', '0', '-5m']:
+        with pytest.raises(argparse.ArgumentTypeError):
+            rac.size(bad)
+
+
+def _fail(self) -> None:
+    raise OSError('not available')
+
+
+def test_scratch_backing_auto(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(rac.Scratch, '_mount_tmpfs', _fail)
+    monkeypatch.setattr(rac.Scratch, '_make_shm', _fail)
+    scratch = rac.Scratch(str(tmp_path / 'scratch'), 4096)
+    scratch.setup()
+    assert scratch.backing == 'dir'
+    assert (tmp_path / 'scratch').is_dir()
+    assert scratch.teardown() == (str(tmp_path / 'scratch'), [])
+
+
+def test_scratch_backing_explicit(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(rac.Scratch, '_mount_tmpfs', _fail)
+    with pytest.raises(OSError):
+        rac.Scratch(str(tmp_path / 'scratch'), 4096, 'tmpfs').setup()
+    # Without a quota, the backing is always a plain directory
+    assert rac.Scratch(str(tmp_path / 'scratch'), None, 'tmpfs').backing == 'dir'
+
+
+def test_scratch_shm(tmp_path, monkeypatch, capsys) -> None:
+    shm = tmp_path / 'shm'
+    shm.mkdir()
+    monkeypatch.setattr(rac, 'SHM_DIR', str(shm))
+    path = tmp_path / 'scratch'
+    scratch = rac.Scratch(str(path), 4096, 'shm')
+    scratch.setup()
+    assert path.is_symlink()
+    assert os.path.dirname(scratch.target) == str(shm)
+    (path / 'data').write_text('x')
+    trash = tmp_path / 'trash'
+    trash.mkdir()
+    rac.cleanup(scratch, rac.Remover(2), str(trash), False, 2, None)
+    assert _wait_until(lambda: list(trash.iterdir()) == [] and list(shm.iterdir()) == [])
+    assert not os.path.lexists(path)
+    assert 'Warning' not in capsys.readouterr().err
+
+
+def test_main_quota_exceeded(tmp_path) -> None:
+    path = tmp_path / 'scratch'
+    start = time.monotonic()
+    result = subprocess.run(
+        [sys.executable, str(SCRIPT), '--scratch-size', '16k', '--scratch-backing', 'dir',
+         '--scratch-check-interval', '0.05', str(path), '--',
+         'sh', '-c', 'head -c 100000 /dev/urandom > "$0/data" && exec sleep 20', str(path)],
+        stderr=subprocess.PIPE, universal_newlines=True, timeout=30)
+    assert result.returncode == 128 + signal.SIGTERM
+    assert time.monotonic() - start < 15
+    assert 'quota of 16384 bytes exceeded' in result.stderr
+    assert not path.exists()
+
+
+@pytest.mark.skipif(shutil.which('capsh') is None, reason='requires capsh')
+def test_main_lowers_sys_admin(tmp_path) -> None:
+    command = ('grep CapAmb /proc/self/status && exec "$0" "$1" --scratch-backing dir -c "$2" -- '
+               'grep CapAmb /proc/self/status')
+    result = subprocess.run(
+        ['capsh', '--inh=cap_sys_admin', '--addamb=cap_sys_admin', '--', '-c', command,
+         sys.executable, str(SCRIPT), str(tmp_path / 'scratch')],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=30)
+    lines = result.stdout.splitlines()
+    if result.returncode != 0 or not lines or lines[0].split()[1] == '0000000000000000':
+        pytest.skip('cannot raise ambient capabilities')
+    assert lines[1].split()[1] == '0000000000000000'
@@ -0,0 +1,115 @@
+import doctest
+import json
+
+import build_profile
+from build_profile import StepParser, annotate, normalise_instruction
+
+
+CLASSIC_OUTPUT = '''\
+Step 1/7 : FROM ubuntu:focal as build
+ ---> 9873176a8f65
+Step 2/7 : RUN make
+ ---> Using cache
+ ---> 1234
+Step 3/7 : FROM ubuntu:focal
+ ---> 9873176a8f65
+Step 4/7 : USER root
+ ---> Running in abcd
+Step 5/7 : COPY --from=build /out /usr/local
+ ---> 5678
+Step 6/7 : RUN apt-get update
+ ---> Running in ef01
+Step 7/7 : USER kat
+ ---> Running in 2345
+Successfully built 6789
+'''
+
+BUILDKIT_OUTPUT = '''\
+#1 [internal] load build definition from Dockerfile
+#1 DONE 0.1s
+#2 [build 1/2] FROM docker.io/library/ubuntu:focal
+#2 CACHED
+#3 [stage-1 1/3] FROM docker.io/library/ubuntu:focal
+#3 CACHED
+#4 [build 2/2] RUN make
+#4 DONE 12.5s
+#5 [stage-1 2/3] COPY --from=build /out /usr/local
+#5 DONE 0.3s
+#6 [stage-1 3/3] RUN apt-get update
+#6 DONE 4.0s
+#7 exporting to image
+#7 DONE 1.0s
+'''
+
+# Oldest first, as returned by image_history
+HISTORY = [
+    ('/bin/sh -c #(nop) ADD file:0123 in / ', 70000000),
+    ('/bin/sh -c #(nop)  CMD ["bash"]', 0),
+    ('', 0),
+    ('/bin/sh -c #(nop)  USER root', 0),
+    ('/bin/sh -c #(nop) COPY dir:4567 in /usr/local ', 3000),
+    ('|1 TAG=latest /bin/sh -c apt-get update', 2000000),
+    ('/bin/sh -c #(nop)  USER kat', 0)
+]
+
+
+def _parse(output: str) -> StepParser:
+    parser = StepParser()
+    for i, line in enumerate(output.splitlines()):
+        parser.feed(line, float(i))
+    parser.finish(100.0)
+    return parser
+
+
+def test_doctests() -> None:
+    assert doctest.testmod(build_profile).failed == 0
+
+
+def test_normalise_instruction() -> None:
+    assert normalise_instruction('RUN |1 A=b /bin/sh -c make   all # buildkit') == 'make all'
+    assert (normalise_instruction('/bin/sh -c #(nop) COPY file:0123 in /x ')
+            == 'COPY file:0123 in /x')
+
+
+def test_step_parser_classic() -> None:
+    parser = _parse(CLASSIC_OUTPUT)
+    assert [step.name for step in parser.steps] == [str(i) for i in range(1, 8)]
+    assert parser.steps[1].cached
+    assert parser.steps[1].time == 3.0
+    assert not parser.steps[5].cached
+    assert [step.name for step in parser.final_stage()] == ['3', '4', '5', '6', '7']
+
+
+def test_step_parser_buildkit() -> None:
+    parser = _parse(BUILDKIT_OUTPUT)
+    times = {step.name: (step.time, step.cached) for step in parser.steps}
+    assert times['build 2/2'] == (12.5, False)
+    assert times['stage-1 1/3'] == (0.0, True)
+    assert [step.instruction for step in parser.final_stage()] == [
+        'FROM docker.io/library/ubuntu:focal',
+        'COPY --from=build /out /usr/local',
+        'RUN apt-get update'
+    ]
+
+
+def test_annotate() -> None:
+    steps = _parse(CLASSIC_OUTPUT).final_stage()
+    previous = HISTORY[:-2] + [('|1 TAG=old /bin/sh -c apt-get update', 1500000)] + HISTORY[-1:]
+    assert annotate(steps, HISTORY, previous) == []
+    sizes = {step.instruction: (step.layer_size, step.previous_size) for step in steps}
+    assert sizes == {
+        'FROM ubuntu:focal': (None, None),
+        'USER root': (None, None),
+        'COPY --from=build /out /usr/local': (3000, 3000),
+        'RUN apt-get update': (2000000, 1500000),
+        'USER kat': (None, None)
+    }
+    assert json.loads(json.dumps(steps[3].to_dict()))['size_delta'] == 500000
+
+
+def test_annotate_mismatch() -> None:
+    steps = _parse(CLASSIC_OUTPUT).final_stage()
+    history = HISTORY[:-2] + [('/bin/sh -c make install', 10)] + HISTORY[-1:]
+    warnings = annotate(steps, history, None)
+    assert len(warnings) == 1
+    assert 'make install' in warnings[0]